@@ -17,8 +17,37 @@ int currentPing = 0;
 #define BUFFER_SIZE 1024      // 128*64/8 (Tüm ekran tamponu)
 #define STATUS_BAR_SIZE 256   // 128*16/8 (İlk 16 piksel / 2 Sayfa)
 
+#define PAGE_SIZE 128          // Bir sayfa: 128 sütun x 8 piksel
+
+// Sürümlü paket: 'O' | sürüm | bayraklar | sıra (uint16 LE) | sayfa maskesi
+// ardından maskedeki her sayfa için 128 bayt (küçük sayfa önce).
+// Tam 1024 baytlık paketler eski formatta tam kare olarak kabul edilir.
+// FLAG_PACKBITS bayrağı varsa sayfa verisi PackBits ile sıkıştırılmıştır.
+// Çizilen her kareden sonra gönderene FLAG_ACK bayraklı 13 baytlık onay
+// döner: 'O' | sürüm | bayraklar | son sıra | çizim süresi (uint32 us) |
+// kareler arası süre (uint16 ms) | reddedilen paket sayısı (uint16)
+// Maskesinde sayfa 0-1 olan paket tam ekran moduna geçirir: bu sayfalar
+// da sunucudan çizilir ve durum çubuğu gösterilmez. Sayfa 0-1 içermeyen
+// tam kare ya da eski formatta bir kare durum çubuğuna geri döndürür.
+#define PACKET_MAGIC 0x4F
+#define PROTOCOL_VERSION 1
+#define HEADER_SIZE 6
+#define MAX_PACKET_SIZE (HEADER_SIZE + BUFFER_SIZE)
+#define IMAGE_PAGES_MASK 0xFC // Sayfa 2-7
+#define FLAG_PACKBITS 0x01
+#define FLAG_ACK 0x80
+#define ACK_SIZE 13
+
 uint8_t displayBuffer[BUFFER_SIZE];
 uint8_t statusBar[STATUS_BAR_SIZE]; // 2 sayfalık (16 piksel) sarı alan için
+uint8_t packetBuffer[MAX_PACKET_SIZE];
+uint8_t decodeBuffer[BUFFER_SIZE];
+
+uint16_t lastSequence = 0;
+bool hasSequence = false;
+uint16_t rejectedPackets = 0;
+IPAddress lastServerIP;
+bool fullScreen = false; // Sayfa 0-1 sunucudan mı geliyor
 
 // I2C pinleri (ESP-C3)
 #define SDA_PIN 21
@@ -144,8 +173,8 @@ void updateStatusDisplay() {
   }
 }
 
-void oledDisplay() {
-  // 1. Status Bar Gönderimi (Page 0 ve 1)
+void oledDisplayStatusBar() {
+  // Status Bar Gönderimi (Page 0 ve 1)
   oledCommand(0x21); oledCommand(0); oledCommand(127);
   oledCommand(0x22); oledCommand(0); oledCommand(1);
   
@@ -157,14 +186,14 @@ void oledDisplay() {
     }
     Wire.endTransmission();
   }
-  
-  // 2. Görüntü Alanı Gönderimi (Page 2'den 7'ye)
+}
+
+void oledDisplayPage(uint8_t page) {
   oledCommand(0x21); oledCommand(0); oledCommand(127);
-  oledCommand(0x22); oledCommand(2); oledCommand(7);
+  oledCommand(0x22); oledCommand(page); oledCommand(page);
   
-  // UDP'den gelen verinin ilk 256 baytı (sarı alan) atlanıyor, 
-  // kalan veri ekranın mavi kısmına basılıyor.
-  for (uint16_t i = 256; i < BUFFER_SIZE; i += 16) {
+  uint16_t start = page * PAGE_SIZE;
+  for (uint16_t i = start; i < start + PAGE_SIZE; i += 16) {
     Wire.beginTransmission(OLED_ADDR);
     Wire.write(0x40);
     for (uint8_t j = 0; j < 16; j++) {
@@ -174,6 +203,125 @@ void oledDisplay() {
   }
 }
 
+// Sadece maskede işaretli görüntü sayfaları (2-7, tam ekranda 0-7) I2C
+// üzerinden gönderilir. Tam ekran dışında UDP'den gelen verinin ilk 256
+// baytı (sarı alan) atlanıyor.
+void oledDisplayPages(uint8_t pageMask) {
+  for (uint8_t page = fullScreen ? 0 : 2; page < 8; page++) {
+    if (pageMask & (1 << page)) {
+      oledDisplayPage(page);
+    }
+  }
+}
+
+void oledDisplay() {
+  oledDisplayStatusBar();
+  oledDisplayPages(IMAGE_PAGES_MASK);
+}
+
+// PackBits çözücü: n < 128 ise n+1 bayt kopyala, n > 128 ise sonraki
+// baytı 257-n kez tekrarla (128 atlanır). Çıkan uzunluğu ya da
+// bozuk/taşan veride -1 döndürür.
+int packbitsDecode(const uint8_t* src, int srcLen, uint8_t* dst, int dstCap) {
+  int in = 0, out = 0;
+  while (in < srcLen) {
+    uint8_t header = src[in++];
+    if (header < 128) {
+      int count = header + 1;
+      if (in + count > srcLen || out + count > dstCap) return -1;
+      memcpy(dst + out, src + in, count);
+      in += count;
+      out += count;
+    } else if (header > 128) {
+      int count = 257 - header;
+      if (in >= srcLen || out + count > dstCap) return -1;
+      memset(dst + out, src[in++], count);
+      out += count;
+    }
+  }
+  return out;
+}
+
+// Sunucu hız kontrolü için onay paketi (gönderenin adres ve portuna)
+void sendAck(uint32_t renderMicros) {
+  uint16_t gap = currentPing > 65535 ? 65535 : currentPing;
+  uint8_t ack[ACK_SIZE] = {
+    PACKET_MAGIC, PROTOCOL_VERSION, FLAG_ACK,
+    (uint8_t)lastSequence, (uint8_t)(lastSequence >> 8),
+    (uint8_t)renderMicros, (uint8_t)(renderMicros >> 8),
+    (uint8_t)(renderMicros >> 16), (uint8_t)(renderMicros >> 24),
+    (uint8_t)gap, (uint8_t)(gap >> 8),
+    (uint8_t)rejectedPackets, (uint8_t)(rejectedPackets >> 8)
+  };
+  udp.beginPacket(udp.remoteIP(), udp.remotePort());
+  udp.write(ack, ACK_SIZE);
+  udp.endPacket();
+}
+
+void handlePagePacket(int packetSize) {
+  udp.read(packetBuffer, packetSize);
+  if (packetBuffer[0] != PACKET_MAGIC || packetBuffer[1] != PROTOCOL_VERSION) {
+    rejectedPackets++;
+    return;
+  }
+  
+  uint8_t flags = packetBuffer[2];
+  uint16_t sequence = packetBuffer[3] | (packetBuffer[4] << 8);
+  uint8_t pageMask = packetBuffer[5];
+  int expected = __builtin_popcount(pageMask) * PAGE_SIZE;
+  
+  const uint8_t* data = packetBuffer + HEADER_SIZE;
+  int dataSize = packetSize - HEADER_SIZE;
+  if (flags & FLAG_PACKBITS) {
+    dataSize = packbitsDecode(data, dataSize, decodeBuffer, BUFFER_SIZE);
+    data = decodeBuffer;
+  }
+  if (dataSize != expected) {
+    rejectedPackets++;
+    return;
+  }
+  
+  // Sırası geçmiş paketleri atla. Tam kareler (ör. sunucu yeniden
+  // başladığında) her zaman kabul edilir.
+  int16_t delta = (int16_t)(sequence - lastSequence);
+  bool keyframe = (pageMask & IMAGE_PAGES_MASK) == IMAGE_PAGES_MASK;
+  if (hasSequence && delta <= 0 && !keyframe) {
+    rejectedPackets++;
+    return;
+  }
+  hasSequence = true;
+  lastSequence = sequence;
+  
+  // Ping hesaplama (iki paket arası süre)
+  unsigned long now = millis();
+  currentPing = now - lastPacketTime;
+  lastPacketTime = now;
+  
+  for (uint8_t page = 0; page < 8; page++) {
+    if (pageMask & (1 << page)) {
+      memcpy(displayBuffer + page * PAGE_SIZE, data, PAGE_SIZE);
+      data += PAGE_SIZE;
+    }
+  }
+  
+  if (pageMask & ~IMAGE_PAGES_MASK) {
+    fullScreen = true;
+  } else if (keyframe && fullScreen) {
+    fullScreen = false;
+    lastServerIP = IPAddress(); // sarı alanı yeniden çiz
+  }
+  
+  // Sarı alan sadece sunucu değiştiğinde yeniden çiziliyor
+  unsigned long renderStart = micros();
+  if (!fullScreen && udp.remoteIP() != lastServerIP) {
+    lastServerIP = udp.remoteIP();
+    updateStatusDisplay();
+    oledDisplayStatusBar();
+  }
+  oledDisplayPages(pageMask);
+  sendAck(micros() - renderStart);
+}
+
 void setup() {
   Wire.begin(SDA_PIN, SCL_PIN);
   Wire.setClock(400000);
@@ -204,9 +352,15 @@ void loop() {
       lastPacketTime = now;
 
       udp.read(displayBuffer, BUFFER_SIZE);
+      fullScreen = false;
+      unsigned long renderStart = micros();
       updateStatusDisplay();
       oledDisplay();
+      sendAck(micros() - renderStart);
+    } else if (packetSize >= HEADER_SIZE && packetSize <= MAX_PACKET_SIZE) {
+      handlePagePacket(packetSize);
     } else {
+      rejectedPackets++;
       while (udp.available()) udp.read();
     }
   }
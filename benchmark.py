@@ -0,0 +1,202 @@
+"""Headless benchmark for the OLED frame pipeline.
+
+Feeds synthetic frames (gradients, text, noise) and desktop screenshots
+through each stage of the pipeline at common desktop resolutions and
+reports per-stage times and frames per second. The screenshots in
+benchmark_fixtures/ are included by default.
+
+    python benchmark.py                                  # all sources, 720p-4K
+    python benchmark.py --resolutions 1080p --frames 50
+    python benchmark.py --fixtures shots/                # use other PNG/JPG screenshots
+    python benchmark.py --fixtures ''                    # synthetic frames only
+    python benchmark.py --save-baseline baseline.json
+    python benchmark.py --compare baseline.json          # exit 1 on regression
+"""
+import argparse
+import json
+import socket
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import code_test as oled
+
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4k': (3840, 2160),
+}
+
+class SyntheticShot:
+    """Stand-in for an mss ScreenShot built from an RGB image."""
+
+    def __init__(self, image):
+        rgb = np.asarray(image.convert('RGB'))
+        bgra = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+        bgra[..., :3] = rgb[..., ::-1]
+        bgra[..., 3] = 255
+        self.size = image.size
+        self.raw = bytearray(bgra.tobytes())
+        self.bgra = bytes(self.raw)
+
+def gradient_frame(width, height):
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    rgb = np.stack([np.broadcast_to(x, (height, width)),
+                    np.broadcast_to(y, (height, width)),
+                    (x + y) / 2], axis=-1)
+    return Image.fromarray(rgb.astype(np.uint8))
+
+def text_frame(width, height):
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    line = 'The quick brown fox jumps over the lazy dog 0123456789 ' * 8
+    for y in range(0, height, 14):
+        draw.text((4, y), line, fill='black')
+    return image
+
+def noise_frame(width, height):
+    rng = np.random.default_rng(width * height)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+SOURCES = {
+    'gradient': gradient_frame,
+    'text': text_frame,
+    'noise': noise_frame,
+}
+
+FIXTURES = Path(__file__).with_name('benchmark_fixtures')
+
+def load_fixtures(directory):
+    """Load real screenshots; each is benchmarked at its own resolution."""
+    fixtures = {}
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix.lower() in ('.png', '.jpg', '.jpeg', '.bmp'):
+            fixtures[f'fixture:{path.stem}'] = Image.open(path).convert('RGB')
+    return fixtures
+
+def time_stage(func, frames):
+    """Run func once per frame and return the per-call times in seconds."""
+    func()  # warm-up (caches, allocations)
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+def bench_frame(image, frames, sender, addr):
+    """Benchmark every stage and the full pipeline on one source frame."""
+    shot = SyntheticShot(image)
+    rgb = Image.frombytes('RGB', shot.size, shot.bgra, 'raw', 'BGRX')
+    fitted = np.asarray(oled.fit_image(rgb, 128, 48))
+    dithered = oled.dither_array(fitted)
+    buffer = oled.encode_oled_pages(dithered)
+    detector = oled.ChangeDetector()
+    converter = oled.GrayscaleConverter()
+    reduced = converter.reduce(shot)
+
+    def full_pipeline():
+        sender.send(oled.pack_for_oled(converter.convert(shot)), addr, force_full=True)
+
+    stages = {
+        # Comparing the box reduction the resample computes anyway
+        'change_detect': lambda: detector.changed(reduced),
+        # PIL path (single /capture requests) and the zero-copy stream path
+        'convert': lambda: Image.frombytes('RGB', shot.size, shot.bgra, 'raw', 'BGRX'),
+        'resize': lambda: oled.fit_image(rgb, 128, 48),
+        'gray_fit': lambda: converter.convert(shot),
+    }
+    # The last resize step with each filter, on the zero-copy capture view
+    for name in oled.RESAMPLE_FILTERS:
+        downscaler = oled.Downscaler(128, 48, name)
+        stages[f'downscale:{name}'] = lambda downscaler=downscaler: downscaler.resize(oled.bgra_view(shot))
+    for mode in oled.DITHER_MODES:
+        stages[f'dither:{mode}'] = lambda mode=mode: oled.dither_array(fitted, mode)
+    stages.update({
+        'pack': lambda: oled.encode_oled_pages(dithered),
+        'compress': lambda: oled.build_page_packet(buffer, 0xFC, 0, compress=True),
+        'send': lambda: sender.send(buffer, addr, force_full=True),
+        'preview': lambda: oled.encode_preview(oled.bgra_view(shot), bgr=True),
+        'pipeline': full_pipeline,
+    })
+
+    results = {}
+    for name, func in stages.items():
+        times = np.array(time_stage(func, frames))
+        results[name] = {
+            'mean_ms': float(times.mean() * 1000),
+            'p95_ms': float(np.percentile(times, 95) * 1000),
+            'fps': float(1 / times.mean()),
+        }
+    return results
+
+def compare(results, baseline, tolerance):
+    """Return (key, stage, baseline ms, current ms) for stages slower than tolerance allows."""
+    regressions = []
+    for key, stages in results.items():
+        for stage, stats in stages.items():
+            old = baseline.get(key, {}).get(stage)
+            if old and stats['mean_ms'] > old['mean_ms'] * (1 + tolerance):
+                regressions.append((key, stage, old['mean_ms'], stats['mean_ms']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--resolutions', default=','.join(RESOLUTIONS),
+                        help='comma-separated subset of ' + ', '.join(RESOLUTIONS))
+    parser.add_argument('--sources', default=','.join(SOURCES),
+                        help='comma-separated subset of ' + ', '.join(SOURCES))
+    parser.add_argument('--fixtures', default=str(FIXTURES),
+                        help='directory of screenshots to include (default benchmark_fixtures/, empty to skip)')
+    parser.add_argument('--frames', type=int, default=20, help='timed runs per stage')
+    parser.add_argument('--save-baseline', metavar='FILE', help='write results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='allowed slowdown before a stage counts as a regression (default 15%%)')
+    args = parser.parse_args()
+
+    frames = {}
+    for name in args.sources.split(','):
+        for res in args.resolutions.split(','):
+            frames[f'{name}@{res}'] = SOURCES[name](*RESOLUTIONS[res])
+    if args.fixtures:
+        frames.update(load_fixtures(args.fixtures))
+
+    # Sends go to a local socket nobody reads, so only the send cost is measured
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sender = oled.FrameSender()
+
+    results = {}
+    for key, image in frames.items():
+        results[key] = bench_frame(image, args.frames, sender, sink.getsockname())
+        print(f'\n{key} ({image.width}x{image.height})')
+        print(f'  {"stage":<26}{"mean ms":>10}{"p95 ms":>10}{"fps":>10}')
+        for stage, stats in results[key].items():
+            print(f'  {stage:<26}{stats["mean_ms"]:>10.3f}{stats["p95_ms"]:>10.3f}{stats["fps"]:>10.1f}')
+
+    sender.close()
+    sink.close()
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(results, indent=2))
+        print(f'\nBaseline saved to {args.save_baseline}')
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:')
+            for key, stage, old, new in regressions:
+                print(f'  {key} {stage}: {old:.3f} ms -> {new:.3f} ms')
+            return 1
+        print(f'\nNo regressions beyond {args.tolerance:.0%} against {args.compare}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
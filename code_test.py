@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, redirect, Response
 import socket
 import io
 import threading
@@ -6,9 +6,23 @@ import time
 import mss
 import mss.tools
 import numpy as np
-from PIL import Image
-import queue
+from PIL import Image, ImageDraw, ImageFont, ImageSequence
 import json
+import struct
+import os
+import argparse
+import asyncio
+import bisect
+import functools
+import hashlib
+import multiprocessing
+import sys
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from multiprocessing import connection, shared_memory
+from urllib.parse import parse_qs, urlsplit
 
 # This is the entire Web Interface (HTML, CSS, and JS)
 HTML_TEMPLATE = """
@@ -110,8 +124,34 @@ HTML_TEMPLATE = """
         <p class="subtitle">Live screen capture to ESP32-C3 OLED</p>
 
         <div class="field">
-            <label>ESP32 IP Address</label>
-            <input type="text" id="espIp" placeholder="e.g. 192.168.1.50" value="192.168.1.100">
+            <label>ESP32 IP Address(es)</label>
+            <input type="text" id="espIp" placeholder="e.g. 192.168.1.50, 192.168.1.51" value="192.168.1.100">
+        </div>
+
+        <div class="field">
+            <label>Monitor</label>
+            <select id="monitorSelect">
+                <option value="1">Monitor 1</option>
+            </select>
+        </div>
+
+        <div class="field">
+            <label>Dithering</label>
+            <select id="ditherSelect">
+                <option value="floyd-steinberg">Floyd-Steinberg</option>
+                <option value="bayer">Ordered (Bayer)</option>
+                <option value="threshold">Threshold</option>
+            </select>
+        </div>
+
+        <div class="field">
+            <label>Resampling</label>
+            <select id="resampleSelect">
+                <option value="lanczos">Lanczos (sharpest)</option>
+                <option value="bicubic">Bicubic</option>
+                <option value="bilinear">Bilinear</option>
+                <option value="box">Box (fastest)</option>
+            </select>
         </div>
 
         <div class="controls">
@@ -137,6 +177,12 @@ HTML_TEMPLATE = """
             <button class="btn danger" id="stopBtn" disabled>Stop Stream</button>
         </div>
 
+        <div class="field">
+            <label>Clip (GIF, APNG, WebP or recording, converted once and looped)</label>
+            <input type="file" id="clipFile">
+            <button class="btn secondary" id="clipBtn">Play Clip</button>
+        </div>
+
         <div class="preview-area">
             <div class="live-preview">
                 <div class="preview-box">
@@ -153,6 +199,7 @@ HTML_TEMPLATE = """
                 <div>Resolution: <span id="resStat">-</span></div>
                 <div>FPS: <span id="fpsStat">0</span></div>
                 <div>Status: <span id="statusText">Ready</span></div>
+                <div id="targetStats"></div>
             </div>
         </div>
 
@@ -173,74 +220,91 @@ HTML_TEMPLATE = """
         const captureBtn = document.getElementById('captureBtn');
         const streamBtn = document.getElementById('streamBtn');
         const stopBtn = document.getElementById('stopBtn');
+        const clipFile = document.getElementById('clipFile');
+        const clipBtn = document.getElementById('clipBtn');
         const originalCanvas = document.getElementById('originalCanvas');
         const oledCanvas = document.getElementById('oledCanvas');
         const regionInput = document.getElementById('regionInput');
+        const monitorSelect = document.getElementById('monitorSelect');
+        const ditherSelect = document.getElementById('ditherSelect');
+        const resampleSelect = document.getElementById('resampleSelect');
         const statusDiv = document.getElementById('status');
         const resStat = document.getElementById('resStat');
         const fpsStat = document.getElementById('fpsStat');
+        const targetStats = document.getElementById('targetStats');
         const statusText = document.getElementById('statusText');
         
         const oledCtx = oledCanvas.getContext('2d');
         const originalCtx = originalCanvas.getContext('2d');
         
         let isStreaming = false;
-        let streamInterval = null;
-        let frameCount = 0;
-        let lastFpsTime = Date.now();
+        let oledFeed = null;
+        const previewImg = new Image();
+        let statusPoll = null;
         let selectedRegion = null;
         let isSelecting = false;
         let selectionStart = null;
         
         // Update slider values
         fpsSlider.oninput = () => fpsValue.textContent = fpsSlider.value;
+        
+        // FPS changes apply to a running stream without restarting it
+        fpsSlider.onchange = () => {
+            if (!isStreaming) return;
+            fetch('/stream_settings', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ fps: parseInt(fpsSlider.value) })
+            });
+        };
         qualitySlider.oninput = () => qualityValue.textContent = qualitySlider.value;
         
         // Region selection on original canvas
+        function selectionPoint(e) {
+            // The canvas is drawn at its CSS size, so positions are taken as a
+            // fraction of the on-page box rather than of the canvas resolution
+            const rect = originalCanvas.getBoundingClientRect();
+            return {
+                x: Math.min(Math.max((e.clientX - rect.left) / rect.width, 0), 1),
+                y: Math.min(Math.max((e.clientY - rect.top) / rect.height, 0), 1)
+            };
+        }
+        
         originalCanvas.addEventListener('mousedown', (e) => {
-            if (!isStreaming) {
-                const rect = originalCanvas.getBoundingClientRect();
-                selectionStart = {
-                    x: e.clientX - rect.left,
-                    y: e.clientY - rect.top
-                };
+            if (!isStreaming && lastCapturedImage) {
+                selectionStart = selectionPoint(e);
                 isSelecting = true;
             }
         });
         
         originalCanvas.addEventListener('mousemove', (e) => {
             if (isSelecting && selectionStart) {
-                const rect = originalCanvas.getBoundingClientRect();
-                const currentX = e.clientX - rect.left;
-                const currentY = e.clientY - rect.top;
+                const current = selectionPoint(e);
+                const width = originalCanvas.width;
+                const height = originalCanvas.height;
                 
                 // Draw selection rectangle
-                originalCtx.clearRect(0, 0, originalCanvas.width, originalCanvas.height);
-                originalCtx.drawImage(lastCapturedImage, 0, 0, originalCanvas.width, originalCanvas.height);
+                originalCtx.clearRect(0, 0, width, height);
+                originalCtx.drawImage(lastCapturedImage, 0, 0, width, height);
                 originalCtx.strokeStyle = '#38bdf8';
                 originalCtx.lineWidth = 2;
                 originalCtx.strokeRect(
-                    selectionStart.x, selectionStart.y,
-                    currentX - selectionStart.x, currentY - selectionStart.y
+                    selectionStart.x * width, selectionStart.y * height,
+                    (current.x - selectionStart.x) * width, (current.y - selectionStart.y) * height
                 );
             }
         });
         
         originalCanvas.addEventListener('mouseup', (e) => {
             if (isSelecting && selectionStart) {
-                const rect = originalCanvas.getBoundingClientRect();
-                const endX = e.clientX - rect.left;
-                const endY = e.clientY - rect.top;
+                const end = selectionPoint(e);
                 
                 // Calculate actual screen coordinates
-                const scaleX = lastScreenWidth / originalCanvas.width;
-                const scaleY = lastScreenHeight / originalCanvas.height;
-                
                 selectedRegion = {
-                    x: Math.round(Math.min(selectionStart.x, endX) * scaleX),
-                    y: Math.round(Math.min(selectionStart.y, endY) * scaleY),
-                    width: Math.round(Math.abs(endX - selectionStart.x) * scaleX),
-                    height: Math.round(Math.abs(endY - selectionStart.y) * scaleY)
+                    x: Math.round(Math.min(selectionStart.x, end.x) * lastScreenWidth),
+                    y: Math.round(Math.min(selectionStart.y, end.y) * lastScreenHeight),
+                    width: Math.round(Math.abs(end.x - selectionStart.x) * lastScreenWidth),
+                    height: Math.round(Math.abs(end.y - selectionStart.y) * lastScreenHeight)
                 };
                 
                 regionInput.value = `${selectedRegion.x},${selectedRegion.y},${selectedRegion.width},${selectedRegion.height}`;
@@ -255,25 +319,53 @@ HTML_TEMPLATE = """
         let lastScreenWidth = 0;
         let lastScreenHeight = 0;
         
-        async function captureScreen() {
+        function captureUrl(region) {
+            const params = new URLSearchParams({ monitor: monitorSelect.value });
+            if (region) {
+                params.set('region', `${region.x},${region.y},${region.width},${region.height}`);
+            }
+            return `/capture?${params}`;
+        }
+        
+        async function loadMonitors() {
             try {
-                const response = await fetch('/capture');
+                const response = await fetch('/monitors');
+                const { monitors } = await response.json();
+                monitorSelect.innerHTML = '';
+                monitors.slice(1).forEach(m => {
+                    const option = document.createElement('option');
+                    option.value = m.index;
+                    option.textContent = `Monitor ${m.index} (${m.width}x${m.height})`;
+                    monitorSelect.appendChild(option);
+                });
+            } catch (error) {
+                console.error('Monitor list error:', error);
+            }
+        }
+        
+        async function captureScreen(region = null) {
+            try {
+                // The server crops to the region, so only full captures are used for selection
+                const response = await fetch(captureUrl(region));
+                if (!response.ok) throw new Error((await response.json()).error);
                 const blob = await response.blob();
                 const img = await createImageBitmap(blob);
                 
-                lastCapturedImage = img;
-                lastScreenWidth = img.width;
-                lastScreenHeight = img.height;
+                if (!region) {
+                    lastCapturedImage = img;
+                    lastScreenWidth = img.width;
+                    lastScreenHeight = img.height;
+                }
                 
                 // Draw to original canvas
                 originalCtx.clearRect(0, 0, originalCanvas.width, originalCanvas.height);
                 originalCtx.drawImage(img, 0, 0, originalCanvas.width, originalCanvas.height);
                 
                 resStat.textContent = `${img.width}x${img.height}`;
-                showStatus('Screen captured successfully', 'success');
+                if (!isStreaming) showStatus('Screen captured successfully', 'success');
                 
                 // Process for OLED preview
-                processForOLED(img);
+                processForOLED(img, region ? null : selectedRegion);
                 
                 return img;
             } catch (error) {
@@ -282,7 +374,7 @@ HTML_TEMPLATE = """
             }
         }
         
-        function processForOLED(img) {
+        function processForOLED(img, region = null) {
             // Create temp canvas for processing
             const tempCanvas = document.createElement('canvas');
             tempCanvas.width = 128;
@@ -294,7 +386,7 @@ HTML_TEMPLATE = """
             tempCtx.fillRect(0, 0, 128, 48);
             
             // Calculate scaling
-            const sourceRegion = selectedRegion || {
+            const sourceRegion = region || {
                 x: 0, y: 0, width: img.width, height: img.height
             };
             
@@ -385,69 +477,160 @@ HTML_TEMPLATE = """
             ctx.putImageData(view, 0, 0);
         }
         
-        async function sendFrame(buffer) {
+        function parseTargets(value) {
+            return value.split(',').map(t => t.trim()).filter(t => t);
+        }
+        
+        // Draw the newest MJPEG frame; the <img> decodes the stream natively
+        function drawPreview() {
+            if (!isStreaming) return;
+            if (previewImg.naturalWidth) {
+                originalCtx.drawImage(previewImg, 0, 0, originalCanvas.width, originalCanvas.height);
+                resStat.textContent = `${previewImg.naturalWidth}x${previewImg.naturalHeight}`;
+            }
+            requestAnimationFrame(drawPreview);
+        }
+        
+        // Render the exact buffers the server sends to the display
+        async function readOledFeed() {
+            oledFeed = new AbortController();
             try {
-                const response = await fetch('/send', {
+                const response = await fetch('/stream_feed?format=oled', { signal: oledFeed.signal });
+                const reader = response.body.getReader();
+                let pending = new Uint8Array(0);
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    const merged = new Uint8Array(pending.length + value.length);
+                    merged.set(pending);
+                    merged.set(value, pending.length);
+                    let offset = 0;
+                    for (; merged.length - offset >= 1024; offset += 1024) {
+                        renderOLEDPreview(merged.subarray(offset, offset + 1024));
+                    }
+                    pending = merged.slice(offset);
+                }
+            } catch (error) {
+                if (error.name !== 'AbortError') console.error('OLED feed error:', error);
+            }
+        }
+        
+        // The server captures, dithers and sends; the page only previews
+        function subscribePreview() {
+            previewImg.src = `/stream_feed?t=${Date.now()}`;
+            requestAnimationFrame(drawPreview);
+            readOledFeed();
+            
+            // Achieved FPS as counted by the server loop
+            let lastFrames = null;
+            statusPoll = setInterval(async () => {
+                try {
+                    const stats = await (await fetch('/status')).json();
+                    if (!stats.streaming) {
+                        await stopStream(false);
+                        if (stats.error) showStatus(`Stream failed: ${stats.error}`, 'error');
+                        return;
+                    }
+                    const frames = stats.frames_processed + stats.frames_skipped;
+                    if (lastFrames !== null) fpsStat.textContent = frames - lastFrames;
+                    lastFrames = frames;
+                    // Per display: FPS it acknowledges vs the requested FPS
+                    targetStats.textContent = Object.entries(stats.targets).map(([target, t]) =>
+                        t.achieved_fps === null
+                            ? `${target}: no feedback`
+                            : `${target}: ${t.achieved_fps} / ${Math.round(t.requested_fps)} fps, render ${t.render_ms} ms`
+                    ).join(' | ');
+                } catch (error) {
+                    console.error('Status error:', error);
+                }
+            }, 1000);
+        }
+        
+        function setStreamingUi(streaming) {
+            isStreaming = streaming;
+            captureBtn.disabled = streaming;
+            streamBtn.disabled = streaming;
+            clipBtn.disabled = streaming;
+            stopBtn.disabled = !streaming;
+            statusText.textContent = streaming ? 'Streaming...' : 'Stopped';
+            if (!streaming) {
+                fpsStat.textContent = '0';
+                targetStats.textContent = '';
+            }
+        }
+        
+        async function startStream() {
+            if (isStreaming) return;
+            
+            try {
+                const response = await fetch('/start_stream', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ 
-                        ip: espIp.value, 
-                        data: Array.from(buffer) 
+                    body: JSON.stringify({
+                        targets: parseTargets(espIp.value),
+                        fps: parseInt(fpsSlider.value),
+                        quality: parseInt(qualitySlider.value),
+                        monitor: parseInt(monitorSelect.value),
+                        region: selectedRegion,
+                        dither: ditherSelect.value,
+                        resample: resampleSelect.value,
+                        preview_size: [originalCanvas.width, originalCanvas.height]
                     })
                 });
-                
-                if (!response.ok) throw new Error('Send failed');
-                return true;
+                const result = await response.json();
+                if (!result.success) throw new Error(result.error);
             } catch (error) {
-                console.error('Frame send error:', error);
-                return false;
+                showStatus(`Stream failed: ${error.message}`, 'error');
+                return;
             }
+            
+            setStreamingUi(true);
+            subscribePreview();
+            showStatus('Stream started', 'success');
         }
         
-        function startStream() {
-            if (isStreaming) return;
-            
-            isStreaming = true;
-            captureBtn.disabled = true;
-            streamBtn.disabled = true;
-            stopBtn.disabled = false;
-            statusText.textContent = 'Streaming...';
-            
-            const fps = parseInt(fpsSlider.value);
-            const interval = 1000 / fps;
+        async function playClip() {
+            if (isStreaming || !clipFile.files.length) return;
             
-            streamInterval = setInterval(async () => {
-                const img = await captureScreen();
-                if (img) {
-                    const buffer = processForOLED(img);
-                    await sendFrame(buffer);
-                    
-                    // Update FPS counter
-                    frameCount++;
-                    const now = Date.now();
-                    if (now - lastFpsTime >= 1000) {
-                        fpsStat.textContent = frameCount;
-                        frameCount = 0;
-                        lastFpsTime = now;
-                    }
-                }
-            }, interval);
+            try {
+                const params = new URLSearchParams({
+                    dither: ditherSelect.value,
+                    resample: resampleSelect.value,
+                    fps: fpsSlider.value
+                });
+                const upload = await (await fetch(`/clips?${params}`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: clipFile.files[0]
+                })).json();
+                if (!upload.success) throw new Error(upload.error);
+                
+                const response = await fetch('/start_stream', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ targets: parseTargets(espIp.value), clip: upload.id })
+                });
+                const result = await response.json();
+                if (!result.success) throw new Error(result.error);
+                showStatus(`Playing ${upload.frames} frames (${upload.duration}s)`, 'success');
+            } catch (error) {
+                showStatus(`Clip failed: ${error.message}`, 'error');
+                return;
+            }
             
-            showStatus('Stream started', 'success');
+            setStreamingUi(true);
+            subscribePreview();
         }
         
-        function stopStream() {
+        async function stopStream(notifyServer = true) {
             if (!isStreaming) return;
             
-            isStreaming = false;
-            clearInterval(streamInterval);
-            
-            captureBtn.disabled = false;
-            streamBtn.disabled = false;
-            stopBtn.disabled = true;
-            statusText.textContent = 'Stopped';
-            fpsStat.textContent = '0';
+            setStreamingUi(false);
+            previewImg.src = '';
+            if (oledFeed) oledFeed.abort();
+            clearInterval(statusPoll);
             
+            if (notifyServer) await fetch('/stop_stream', { method: 'POST' });
             showStatus('Stream stopped', 'info');
         }
         
@@ -462,21 +645,29 @@ HTML_TEMPLATE = """
         }
         
         // Event listeners
-        captureBtn.addEventListener('click', captureScreen);
+        captureBtn.addEventListener('click', () => captureScreen());
+        
+        monitorSelect.addEventListener('change', () => {
+            selectedRegion = null;
+            regionInput.value = '';
+            captureScreen();
+        });
         
         streamBtn.addEventListener('click', () => {
             if (!isStreaming) startStream();
         });
         
-        stopBtn.addEventListener('click', stopStream);
-        
-        // Initial capture
-        captureScreen();
+        stopBtn.addEventListener('click', () => stopStream());
+        clipBtn.addEventListener('click', () => playClip());
         
-        // Cleanup on page unload
-        window.addEventListener('beforeunload', () => {
-            if (isStreaming) {
-                fetch('/stop_stream', { method: 'POST' });
+        // Initial capture, or attach to a stream that is already running
+        loadMonitors().then(async () => {
+            const stats = await (await fetch('/status')).json();
+            if (stats.streaming) {
+                setStreamingUi(true);
+                subscribePreview();
+            } else {
+                captureScreen();
             }
         });
     </script>
@@ -488,205 +679,2511 @@ app = Flask(__name__)
 
 # Global variables for screen capture
 streaming = False
-stream_thread = None
+stream_future = None
+# Why the last stream ended early, or its newest capture error
+stream_error = None
+stream_sender = None
+stream_scheduler = None
+stream_converter = None
+# Recording replayed instead of the live screen (set with --replay)
+replay_path = None
 stop_event = threading.Event()
-frame_queue = queue.Queue(maxsize=10)
+stream_stats = {'frames_processed': 0, 'frames_skipped': 0, 'keepalives_sent': 0, 'frames_late': 0}
+# Newest preview JPEG of a running screen stream, served by /capture instead of
+# a grab in this process; snapshot_wanted asks the workers for a fresh one
+stream_snapshot = {'active': False, 'jpeg': None, 'time': 0.0}
+snapshot_wanted = threading.Event()
+snapshot_ready = threading.Condition()
+
+# Histogram bucket bounds (seconds) shared by all pipeline stages
+METRIC_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+PIPELINE_STAGES = ('grab', 'reduce', 'convert', 'resize', 'dither', 'pack', 'send', 'preview')
+
+class Histogram:
+    """Cumulative timing histogram that also keeps a window of recent samples for percentiles."""
+
+    def __init__(self, buckets=METRIC_BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.total += seconds
+            self.count += 1
+            self.recent.append(seconds)
+
+    def percentiles(self, quantiles=(0.5, 0.9, 0.99)):
+        with self.lock:
+            samples = list(self.recent)
+        if not samples:
+            return {q: 0.0 for q in quantiles}
+        return dict(zip(quantiles, np.quantile(samples, quantiles).tolist()))
+
+class PipelineMetrics:
+    """Per-stage timings and end-to-end latency of the frame pipeline."""
+
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in PIPELINE_STAGES}
+        self.latency = Histogram()
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage].observe(time.perf_counter() - start)
+
+pipeline_metrics = PipelineMetrics()
+
+def stage_timer(metrics, stage):
+    """metrics.time(stage), or a no-op when metrics is None."""
+    return metrics.time(stage) if metrics is not None else nullcontext()
+
+DITHER_MODES = ('floyd-steinberg', 'bayer', 'threshold')
+
+# 8x8 Bayer matrix scaled to 0-255 thresholds for ordered dithering
+BAYER_8X8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32)
+BAYER_8X8 = (BAYER_8X8 + 0.5) * (255.0 / 64.0)
+
+_skew_cache = {}
+_FS_WEIGHTS = np.array([[3], [5], [1], [7]], dtype=np.float32)
+# 0-d arrays, which ufuncs take with less overhead than Python or NumPy scalars
+_FS_THRESHOLD = np.array(127, dtype=np.float32)
+_FS_WHITE = np.array(255, dtype=np.float32)
+_FS_SIXTEENTH = np.array(1/16, dtype=np.float32)
+# Per-thread Floyd-Steinberg buffers, as wall tiles are dithered concurrently
+_fs_local = threading.local()
+
+def _skew_indices(height, width):
+    """Index arrays mapping (y, x) to the skewed diagonal layout (x + 2y, y)."""
+    key = (height, width)
+    if key not in _skew_cache:
+        ys, xs = np.indices((height, width))
+        _skew_cache[key] = (xs + 2 * ys, ys)
+    return _skew_cache[key]
+
+def _fs_plan(height, width):
+    """This thread's skew buffers for one image size and the views each diagonal step works on.
+
+    Built once per size, so the diagonal loop only runs ufuncs into
+    preallocated buffers instead of slicing and allocating every step.
+    """
+    plans = getattr(_fs_local, 'plans', None)
+    if plans is None:
+        plans = _fs_local.plans = {}
+    key = (height, width)
+    if key not in plans:
+        steps = width + 2 * (height - 1)
+        # Spare rows/column absorb pushes past the right and bottom edges
+        skew = np.zeros((steps + 3, height + 1), dtype=np.float32)
+        # The quantized pixels, in the same layout
+        levels = np.zeros((steps, height), dtype=bool)
+        pushes = np.empty((4, height), dtype=np.float32)
+        views = []
+        for t in range(steps):
+            lo = max(0, (t - width + 2) // 2)
+            hi = min(height, t // 2 + 1)
+            n = hi - lo
+            # Rows t+1..t+3 of the next pixel row get the 3/16, 5/16, 1/16 terms
+            views.append((skew[t, lo:hi], levels[t, lo:hi], pushes[:, :n],
+                          skew[t + 1:t + 4, lo + 1:hi + 1], pushes[:3, :n], skew[t + 1, lo:hi], pushes[3, :n]))
+        plans[key] = (skew, levels, views)
+    return plans[key]
 
-def dither_image(image):
-    """Convert image to 1-bit dithered using Floyd-Steinberg algorithm."""
+def _floyd_steinberg(gray_array):
+    """Floyd-Steinberg on a float32 array, one anti-diagonal at a time.
+
+    Pixel (y, x) only depends on (y, x-1) and (y-1, x-1..x+1), so every pixel
+    on the line x + 2y = t can be quantized together. The image is stored
+    skewed so that line t is the contiguous row skew[t]. Errors are pushed in
+    the same order as the scalar loop (1/16, 5/16, 3/16, 7/16), which keeps
+    the float32 sums, and therefore the output, bit-identical.
+    """
+    height, width = gray_array.shape
+    skew, levels, views = _fs_plan(height, width)
+    diag, rows = _skew_indices(height, width)
+    skew.fill(0)
+    skew[diag, rows] = gray_array
+
+    greater, subtract, multiply, add = np.greater, np.subtract, np.multiply, np.add
+    for line, level, pushes, below, below_pushes, right, right_push in views:
+        greater(line, _FS_THRESHOLD, out=level)
+        # The line becomes its error: 255 comes off the pixels that turn white
+        subtract(line, _FS_WHITE, out=line, where=level)
+        # weights[i] * err is rounded to float32 before the exact /16
+        multiply(_FS_WEIGHTS, line, out=pushes)
+        multiply(pushes, _FS_SIXTEENTH, out=pushes)
+        add(below, below_pushes, out=below)
+        add(right, right_push, out=right)
+
+    return levels[diag, rows] * np.float32(255)
+
+def dither_array(gray_array, mode='floyd-steinberg'):
+    """Dither a 2D grayscale array to a uint8 array of 0/255 values."""
+    gray_array = np.asarray(gray_array, dtype=np.float32)
+
+    if mode == 'floyd-steinberg':
+        result = _floyd_steinberg(gray_array)
+    elif mode == 'bayer':
+        height, width = gray_array.shape
+        tiles = (-(-height // 8), -(-width // 8))
+        thresholds = np.tile(BAYER_8X8, tiles)[:height, :width]
+        result = np.where(gray_array > thresholds, 255, 0)
+    elif mode == 'threshold':
+        result = np.where(gray_array > 127, 255, 0)
+    else:
+        raise ValueError(f"Unknown dither mode: {mode}")
+
+    return result.astype(np.uint8)
+
+def dither_image(image, mode='floyd-steinberg'):
+    """Convert image to 1-bit dithered using the selected dither mode."""
     # Convert to grayscale
     gray = image.convert('L')
     gray_array = np.array(gray, dtype=np.float32)
-    
-    # Apply Floyd-Steinberg dithering
-    height, width = gray_array.shape
-    for y in range(height):
-        for x in range(width):
-            old_pixel = gray_array[y, x]
-            new_pixel = 255 if old_pixel > 127 else 0
-            gray_array[y, x] = new_pixel
-            quant_error = old_pixel - new_pixel
-            
-            if x + 1 < width:
-                gray_array[y, x + 1] += quant_error * 7/16
-            if y + 1 < height:
-                if x > 0:
-                    gray_array[y + 1, x - 1] += quant_error * 3/16
-                gray_array[y + 1, x] += quant_error * 5/16
-                if x + 1 < width:
-                    gray_array[y + 1, x + 1] += quant_error * 1/16
-    
+
     # Convert back to image
-    return Image.fromarray(gray_array.astype(np.uint8))
+    return Image.fromarray(dither_array(gray_array, mode))
 
-def process_for_oled(image, target_width=128, target_height=48):
-    """Process image for OLED display (128x48 image area)."""
+OLED_WIDTH = 128
+OLED_BUFFER_SIZE = 1024
+
+# SSD1306 page layouts: first page carrying image data and number of image rows.
+# 'split' leaves pages 0-1 to the firmware's status bar, 'full' uses all 64 rows.
+OLED_LAYOUTS = {
+    'split': (2, 48),
+    'full': (0, 64),
+}
+
+def encode_oled_pages(pixels, layout='split'):
+    """Pack a 1-bit (bool or 0/255 uint8) array into a 1024-byte SSD1306 page buffer.
+
+    Each page byte holds 8 vertically stacked pixels with the top one in bit 0.
+    Rows beyond the layout are dropped and missing rows are left black. The
+    returned OledFrame supports the buffer protocol, so it can go straight to
+    sock.sendto() without a copy.
+    """
+    return OledFrame.from_pixels(pixels, layout)
+
+def decode_oled_pages(buffer, layout='split'):
+    """Unpack an SSD1306 page buffer back to a (rows, 128) uint8 array of 0/255."""
+    first_page, rows = OLED_LAYOUTS[layout]
+    data = np.frombuffer(buffer, dtype=np.uint8, count=OLED_BUFFER_SIZE)
+    pages = data[first_page * OLED_WIDTH:].reshape(rows // 8, OLED_WIDTH, 1)
+    bits = np.unpackbits(pages, axis=-1, bitorder='little')
+    return bits.transpose(0, 2, 1).reshape(rows, OLED_WIDTH) * np.uint8(255)
+
+BLIT_OPS = ('copy', 'or', 'xor', 'and')
+
+class OledFrame(bytearray):
+    """A packed SSD1306 frame that knows its geometry.
+
+    The frame is its own preallocated byte buffer (width x height / 8 bytes,
+    page-major), so it goes to sock.sendto(), np.frombuffer() or anything
+    else taking bytes without a copy; pages is a (page, column) uint8 view of
+    it. With the 'split' layout the first two pages belong to the firmware's
+    status bar and are left out of the image area, dirty masks and invert.
+    Diffs, blits, inverts and text overlays all work on the packed bytes, a
+    whole page column at a time.
+    """
+    __slots__ = ('width', 'height', 'layout', 'first_page')
+
+    def __init__(self, layout='split', height=64, width=OLED_WIDTH):
+        first_page = OLED_LAYOUTS[layout][0]
+        if height % 8 or height <= first_page * 8:
+            raise ValueError(f'Height {height} does not fit the {layout} layout')
+        super().__init__(width * height // 8)
+        self.width = width
+        self.height = height
+        self.layout = layout
+        self.first_page = first_page
+
+    @classmethod
+    def from_pixels(cls, pixels, layout='split', height=64, width=OLED_WIDTH):
+        """Pack a 1-bit (bool or 0/255 uint8) array into the image area of a new frame."""
+        frame = cls(layout, height, width)
+        rows = frame.image_rows
+        pixels = np.asarray(pixels)
+        if pixels.dtype != np.bool_:
+            pixels = pixels > 127
+
+        bits = np.zeros((rows, width), dtype=np.bool_)
+        pixels = pixels[:rows, :width]
+        bits[:pixels.shape[0], :pixels.shape[1]] = pixels
+        # (rows, width) -> (pages, width, 8) so each packed byte is one page column
+        columns = bits.reshape(rows // 8, 8, width).transpose(0, 2, 1)
+        frame.pages[frame.first_page:] = np.packbits(columns, axis=-1, bitorder='little')[..., 0]
+        return frame
+
+    @property
+    def pages(self):
+        # Built per access: storing the view would make an uncollectable cycle
+        return np.frombuffer(self, dtype=np.uint8).reshape(self.height // 8, self.width)
+
+    @property
+    def image_rows(self):
+        return self.height - self.first_page * 8
+
+    @property
+    def image_mask(self):
+        """Page mask with every image page set."""
+        return (1 << self.height // 8) - (1 << self.first_page)
+
+    def pixels(self):
+        """Unpack the image area to a (rows, width) uint8 array of 0/255."""
+        pages = self.pages[self.first_page:, :, None]
+        bits = np.unpackbits(pages, axis=-1, bitorder='little')
+        return bits.transpose(0, 2, 1).reshape(self.image_rows, self.width) * np.uint8(255)
+
+    def _other(self, other):
+        return np.frombuffer(other, dtype=np.uint8, count=len(self)).reshape(self.height // 8, self.width)
+
+    def diff(self, other):
+        """Frame of the bits that differ from other (any buffer of the same size)."""
+        result = OledFrame(self.layout, self.height, self.width)
+        np.bitwise_xor(self.pages, self._other(other), out=result.pages)
+        return result
+
+    def dirty_mask(self, other):
+        """Bit mask of the image pages that differ from other."""
+        dirty = (self.pages != self._other(other)).any(axis=1)
+        dirty[:self.first_page] = False
+        return int.from_bytes(np.packbits(dirty, bitorder='little').tobytes(), 'little')
+
+    def invert(self, x=0, y=0, width=None, height=None):
+        """Invert a rectangle of the image area (all of it by default), in place."""
+        width = self.width if width is None else width
+        height = self.image_rows if height is None else height
+        # One byte mask per page covering the rectangle's rows, then XOR per column
+        rows = np.zeros(self.height, dtype=np.bool_)
+        rows[self.first_page * 8:][max(y, 0):max(y + height, 0)] = True
+        masks = np.packbits(rows.reshape(-1, 8), axis=-1, bitorder='little')
+        self.pages[:, max(x, 0):max(x + width, 0)] ^= masks
+        return self
+
+    def blit(self, source, x=0, y=0, op='copy'):
+        """Draw source (an OledFrame) with its top left at pixel (x, y), in place.
+
+        y counts from the top of the whole frame, so it may land in the status
+        bar. 'copy' replaces the covered pixels, 'or' draws the set ones,
+        'xor' flips under them and 'and' keeps only what both have set. A y
+        that is not a multiple of 8 shifts each source page across two
+        destination pages. Whatever falls outside the frame is clipped.
+        """
+        if op not in BLIT_OPS:
+            raise ValueError(f'Unknown blit op: {op}')
+        left = max(x, 0)
+        right = min(x + source.width, self.width)
+        if left >= right:
+            return self
+
+        page, shift = divmod(y, 8)
+        src = source.pages[:, left - x:right - x].astype(np.uint16) << shift
+        # A shifted source page spans two destination pages: low byte, then high byte
+        count = src.shape[0] + 1
+        data = np.zeros((count, right - left), dtype=np.uint8)
+        data[:-1] = src & 0xFF
+        data[1:] |= (src >> 8).astype(np.uint8)
+        covered = np.zeros(count, dtype=np.uint8)
+        covered[:-1] = (0xFF << shift) & 0xFF
+        covered[1:] |= 0xFF >> (8 - shift)
+
+        top = max(page, 0)
+        bottom = min(page + count, self.height // 8)
+        if top >= bottom:
+            return self
+        data = data[top - page:bottom - page]
+        covered = covered[top - page:bottom - page, None]
+        dest = self.pages[top:bottom, left:right]
+        if op == 'copy':
+            dest &= ~covered
+            dest |= data
+        elif op == 'or':
+            dest |= data
+        elif op == 'xor':
+            dest ^= data
+        else:
+            dest &= data | ~covered
+        return self
+
+    def draw_text(self, text, x=0, y=0, op='xor'):
+        """Composite a line of text at pixel (x, y) of the image area, in place.
+
+        'xor' (the default) keeps text readable over any image.
+        """
+        return self.blit(text_sprite(text), x, y + self.first_page * 8, op)
+
+@functools.lru_cache(maxsize=256)
+def text_sprite(text):
+    """Packed 'full' OledFrame of text in PIL's default font, cached per string.
+
+    Sprites are shared, so treat them as read-only.
+    """
+    font = ImageFont.load_default()
+    left, top, right, bottom = font.getbbox(text)
+    width = max(right, 1)
+    height = max(-(-bottom // 8) * 8, 8)
+    image = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(image).text((0, 0), text, fill=255, font=font)
+    return OledFrame.from_pixels(np.asarray(image), 'full', height, width)
+
+def fit_size(width, height, target_width, target_height):
+    """Return the (width, height) of a width x height image scaled to fit the target."""
     # Scale image to fit target dimensions while maintaining aspect ratio
-    img_ratio = image.width / image.height
+    img_ratio = width / height
     target_ratio = target_width / target_height
     
     if img_ratio > target_ratio:
         # Image is wider
-        new_width = target_width
-        new_height = int(target_width / img_ratio)
-    else:
-        # Image is taller
-        new_height = target_height
-        new_width = int(target_height * img_ratio)
-    
-    # Resize image
-    resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        return target_width, int(target_width / img_ratio)
+    # Image is taller
+    return int(target_height * img_ratio), target_height
+
+# Filters for the last resize step, sharpest first
+RESAMPLE_FILTERS = {
+    'lanczos': Image.Resampling.LANCZOS,
+    'bicubic': Image.Resampling.BICUBIC,
+    'bilinear': Image.Resampling.BILINEAR,
+    'box': Image.Resampling.BOX,
+    'nearest': Image.Resampling.NEAREST,
+}
+
+class Downscaler:
+    """Aspect-fit images onto a fixed target size in two steps.
+
+    A cheap integer box reduction (Image.reduce) first brings the source to
+    within reducing_gap times the fitted size, and only that small image goes
+    through the resample filter. The fit, the letterbox offset, the reduce
+    factor and the exact source box in reduced pixels are computed once per
+    source size. With Lanczos and the default gap the output is within a
+    gray level of a single full-resolution Lanczos pass.
+    """
+
+    def __init__(self, width, height, resample='lanczos', reducing_gap=3.0):
+        if resample not in RESAMPLE_FILTERS:
+            raise ValueError(f'Unknown resample filter: {resample}')
+        self.width = width
+        self.height = height
+        self.resample = resample
+        self.filter = RESAMPLE_FILTERS[resample]
+        self.reducing_gap = reducing_gap
+        self.plans = {}
+
+    def plan(self, size):
+        """Return (fit size, paste offset, reduce factor, reduced box) for a source size."""
+        plan = self.plans.get(size)
+        if plan is None:
+            width, height = size
+            fit_width, fit_height = fit_size(width, height, self.width, self.height)
+            factor = (int(width / fit_width / self.reducing_gap) or 1,
+                      int(height / fit_height / self.reducing_gap) or 1)
+            # reduce() rounds partial edge boxes up, so the box keeps the mapping exact
+            plan = self.plans[size] = (
+                (fit_width, fit_height),
+                ((self.width - fit_width) // 2, (self.height - fit_height) // 2),
+                factor,
+                (0, 0, width / factor[0], height / factor[1]),
+            )
+        return plan
+
+    def reduce(self, image):
+        """Return the integer box reduction of image, the first step of resize()."""
+        _, _, factor, _ = self.plan(image.size)
+        return image.reduce(factor) if factor != (1, 1) else image
+
+    def resize(self, image, reduced=None):
+        """Return image scaled to its fitted size, without the letterbox.
+
+        reduced is reduce(image), when the caller already has it.
+        """
+        fit, _, _, box = self.plan(image.size)
+        if reduced is None:
+            reduced = self.reduce(image)
+        return reduced.resize(fit, self.filter, box)
+
+# Downscalers only hold geometry, so one per target and filter is shared by all threads
+downscalers = {}
+
+def get_downscaler(width, height, resample='lanczos'):
+    key = (width, height, resample)
+    if key not in downscalers:
+        downscalers[key] = Downscaler(width, height, resample)
+    return downscalers[key]
+
+def fit_image(image, target_width, target_height, resample='lanczos'):
+    """Scale image to fit the target while keeping its aspect ratio, centered on black."""
+    downscaler = get_downscaler(target_width, target_height, resample)
+    _, offset, _, _ = downscaler.plan(image.size)
     
-    # Create new image with black background
+    # Create new image with black background and paste the resized image in center
     result = Image.new('L', (target_width, target_height), 0)
-    
-    # Paste resized image in center
-    paste_x = (target_width - new_width) // 2
-    paste_y = (target_height - new_height) // 2
-    result.paste(resized, (paste_x, paste_y))
-    
+    result.paste(downscaler.resize(image), offset)
+    return result
+
+def tone_lut(gamma=1.0, contrast=1.0, invert=False):
+    """256-entry float32 table applying gamma, contrast and invert to gray levels.
+
+    gamma above 1 brightens the mid-tones, contrast scales around mid-gray.
+    Entries are rounded to whole levels, so the defaults map every level to
+    itself.
+    """
+    if gamma <= 0 or contrast < 0:
+        raise ValueError('Gamma must be positive and contrast not negative')
+    levels = np.arange(256, dtype=np.float64) / 255
+    levels = (levels ** (1 / gamma) - 0.5) * contrast + 0.5
+    if invert:
+        levels = 1 - levels
+    return np.rint(np.clip(levels, 0, 1) * 255).astype(np.float32)
+
+# Fixed-point BGRX -> gray weights, the same ones PIL uses for RGB -> 'L'
+GRAY_WEIGHTS = np.array([7471, 38470, 19595, 0], dtype=np.uint32)
+
+def bgra_view(screenshot):
+    """Wrap a capture's BGRA pixels in a PIL image without copying them.
+
+    The bands come out in memory order (B, G, R, X); resampling treats them
+    the same either way.
+    """
+    return Image.frombuffer('RGBX', screenshot.size, screenshot.raw, 'raw', 'RGBX', 0, 1)
+
+class GrayscaleConverter:
+    """Fit BGRA captures onto a grayscale canvas without copying the capture.
+
+    The capture buffer is resampled in place by a Downscaler (an integer box
+    reduction first, then the resample filter on the small image), and only
+    the reduced pixels are turned to gray and mapped through the tone LUT.
+    The canvas and gray scratch buffer are reused, so the returned canvas is
+    overwritten by the next call. PIL cannot write into existing buffers, so
+    each frame still allocates the reduced image, the resized image and the
+    array copy of it; all are a few times the fitted size at most, never
+    the size of the capture. Letterbox bars stay black.
+    """
+
+    def __init__(self, width=128, height=48, gamma=1.0, contrast=1.0, invert=False, resample='lanczos'):
+        self.width = width
+        self.height = height
+        self.downscaler = get_downscaler(width, height, resample)
+        self.canvas = np.zeros((height, width), dtype=np.float32)
+        self.source_size = None
+        self.set_tone(gamma, contrast, invert)
+
+    def set_tone(self, gamma=1.0, contrast=1.0, invert=False):
+        self.tone = {'gamma': gamma, 'contrast': contrast, 'invert': invert}
+        self.lut = tone_lut(gamma, contrast, invert)
+
+    def _layout(self, size):
+        # Scratch buffers only change with the capture size
+        (fit_width, fit_height), (x, y), _, _ = self.downscaler.plan(size)
+        self.source_size = size
+        self.canvas[:] = 0
+        self.image = self.canvas[y:y + fit_height, x:x + fit_width]
+        self.gray = np.empty((fit_height, fit_width), dtype=np.uint32)
+
+    def reduce(self, screenshot, metrics=None):
+        """Box-reduce a capture: the first step of convert() and what a ChangeDetector compares."""
+        with stage_timer(metrics, 'reduce'):
+            return self.downscaler.reduce(bgra_view(screenshot))
+
+    def convert(self, screenshot, metrics=None, reduced=None):
+        """Return the (height, width) float32 canvas for a capture (reduced is reduce(screenshot), if known)."""
+        if screenshot.size != self.source_size:
+            self._layout(screenshot.size)
+        if reduced is None:
+            reduced = self.reduce(screenshot, metrics)
+        with stage_timer(metrics, 'resize'):
+            small = self.downscaler.resize(bgra_view(screenshot), reduced)
+        with stage_timer(metrics, 'convert'):
+            np.dot(np.asarray(small), GRAY_WEIGHTS, out=self.gray)
+            self.gray += 0x8000
+            self.gray >>= 16
+            self.lut.take(self.gray, out=self.image, mode='clip')
+        return self.canvas
+
+    def convert_image(self, image, metrics=None):
+        """Return the canvas for a PIL image of any mode (e.g. a /capture frame)."""
+        if image.size != self.source_size:
+            self._layout(image.size)
+        with stage_timer(metrics, 'resize'):
+            small = self.downscaler.resize(image)
+        with stage_timer(metrics, 'convert'):
+            self.lut.take(np.asarray(small.convert('L')), out=self.image, mode='clip')
+        return self.canvas
+
+# Converters reuse their canvas, so every thread keeps its own per target and filter
+local_converters = threading.local()
+
+def get_converter(width, height, resample='lanczos'):
+    converters = local_converters.__dict__.setdefault('converters', {})
+    key = (width, height, resample)
+    if key not in converters:
+        converters[key] = GrayscaleConverter(width, height, resample=resample)
+    return converters[key]
+
+def process_for_oled(image, target_width=128, target_height=48, dither='floyd-steinberg', layout='split',
+                     metrics=None, resample='lanczos'):
+    """Process image for OLED display (128x48 image area)."""
+    canvas = get_converter(target_width, target_height, resample).convert_image(image, metrics)
+    return pack_for_oled(canvas, dither, layout, metrics)
+
+def pack_for_oled(gray, dither='floyd-steinberg', layout='split', metrics=None):
+    """Dither an already fitted grayscale array and pack it into an OLED buffer."""
     # Apply dithering
-    dithered = dither_image(result)
-    
-    # Convert to OLED buffer format (1024 bytes)
-    buffer = bytearray(1024)
+    with stage_timer(metrics, 'dither'):
+        dithered = dither_array(gray, dither)
     
-    # Fill image data (pages 2-7, bytes 256-1023)
-    pixels = dithered.load()
-    for page in range(2, 8):
-        for x in range(128):
-            byte = 0
-            for bit in range(8):
-                y = (page - 2) * 8 + bit
-                if y < target_height:  # Safety check
-                    pixel_value = pixels[x, y]
-                    if pixel_value > 127:
-                        byte |= (1 << bit)
-            buffer[page * 128 + x] = byte
+    # Convert to OLED buffer format (1024 bytes, pages 2-7 for the split layout)
+    with stage_timer(metrics, 'pack'):
+        return encode_oled_pages(dithered, layout)
+
+class VideoWall:
+    """A grid of displays that together show one capture.
+
+    Tiles are numbered row-major and each one goes to its own target. A
+    tile_height of 48 uses the status-bar layout, 64 the full-screen layout,
+    whose packets carry pages 0-1 and so switch the firmware to full screen.
+    """
+
+    def __init__(self, cols, rows, targets, tile_height=48):
+        if tile_height not in (48, 64):
+            raise ValueError('Tile height must be 48 or 64')
+        if cols < 1 or rows < 1 or len(targets) != cols * rows:
+            raise ValueError(f'Wall of {cols}x{rows} needs {cols * rows} targets')
+        self.cols = cols
+        self.rows = rows
+        self.targets = targets
+        self.tile_height = tile_height
+        self.layout = 'split' if tile_height == 48 else 'full'
+        self.width = cols * OLED_WIDTH
+        self.height = rows * tile_height
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a wall from a {cols, rows, tile_height, targets} dict."""
+        return cls(
+            int(config['cols']),
+            int(config['rows']),
+            [parse_target(t) for t in config['targets']],
+            int(config.get('tile_height', 48)),
+        )
+
+    def split(self, pixels):
+        """Yield the (tile_height, 128) pixel view for each tile, row-major."""
+        for row in range(self.rows):
+            for col in range(self.cols):
+                yield pixels[row * self.tile_height:(row + 1) * self.tile_height,
+                             col * OLED_WIDTH:(col + 1) * OLED_WIDTH]
+
+def process_for_wall(image, wall, dither='floyd-steinberg', executor=None, metrics=None, resample='lanczos'):
+    """Process one capture into a packed OLED buffer per wall tile.
+
+    The capture is resized once to the whole wall, so tiles line up with no
+    resampling seams. Floyd-Steinberg runs over the whole wall, so error
+    diffusion carries across tile edges. Its diagonal wavefront already
+    vectorizes over every wall row. Bayer and threshold dithering are per
+    pixel, so each tile is dithered and packed in the executor. numpy
+    releases the GIL, so a thread pool gives real parallelism here.
+    """
+    canvas = get_converter(wall.width, wall.height, resample).convert_image(image, metrics)
+    return pack_for_wall(canvas, wall, dither, executor, metrics)
+
+def pack_for_wall(canvas, wall, dither='floyd-steinberg', executor=None, metrics=None):
+    """Dither and pack a grayscale canvas already fitted to the wall, one buffer per tile."""
+    tile_modes = ('bayer', 'threshold')
+
+    if dither in tile_modes:
+        def process_tile(tile):
+            with stage_timer(metrics, 'dither'):
+                tile = dither_array(tile, dither)
+            with stage_timer(metrics, 'pack'):
+                return encode_oled_pages(tile, wall.layout)
+    else:
+        with stage_timer(metrics, 'dither'):
+            canvas = dither_array(canvas, dither)
+
+        def process_tile(tile):
+            with stage_timer(metrics, 'pack'):
+                return encode_oled_pages(tile, wall.layout)
+
+    tiles = wall.split(canvas)
+    if executor is None:
+        return [process_tile(tile) for tile in tiles]
+    return list(executor.map(process_tile, tiles))
+
+def parse_region(value):
+    """Parse a region given as {x, y, width, height}, [x, y, w, h] or "x,y,w,h"."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, dict):
+        value = [value.get('x', 0), value.get('y', 0), value.get('width'), value.get('height')]
+    elif isinstance(value, str):
+        value = value.split(',')
+
+    x, y, width, height = (int(float(v)) for v in value)
+    if width <= 0 or height <= 0:
+        raise ValueError('Region must have a positive size')
+    return (x, y, width, height)
+
+def capture_rect(sct, monitor_index=1, region=None):
+    """Build the mss grab rectangle for a monitor, cropped to an optional region.
+
+    The region is in monitor-relative pixels and is clamped to the monitor,
+    so mss only copies the pixels we actually use.
+    """
+    monitors = sct.monitors
+    if not 0 <= monitor_index < len(monitors):
+        raise ValueError(f'Monitor {monitor_index} not found')
+    monitor = monitors[monitor_index]
+
+    if region is None:
+        return monitor
+
+    x, y, width, height = region
+    left = min(max(x, 0), monitor['width'] - 1)
+    top = min(max(y, 0), monitor['height'] - 1)
+    right = min(x + width, monitor['width'])
+    bottom = min(y + height, monitor['height'])
+    if right <= left or bottom <= top:
+        raise ValueError('Region is outside the monitor')
+
+    return {
+        'left': monitor['left'] + left,
+        'top': monitor['top'] + top,
+        'width': right - left,
+        'height': bottom - top,
+    }
+
+# UDP wire protocol. A plain 1024-byte datagram is a full legacy frame.
+# Versioned packets start with a 6-byte header followed by 128 bytes for
+# every page set in the page mask, lowest page first:
+#   magic 'O' | version | flags | sequence (uint16 LE) | page mask
+# With FLAG_PACKBITS set, the page bytes are PackBits run-length encoded.
+# Displays answer every frame they draw with a FLAG_ACK packet:
+#   magic | version | flags | last sequence | render time (uint32 us) |
+#   gap since the previous frame (uint16 ms) | packets rejected (uint16)
+OLED_PORT = 8888
+PACKET_MAGIC = 0x4F
+PROTOCOL_VERSION = 1
+PACKET_HEADER = struct.Struct('<BBBHB')
+OLED_PAGES = OLED_BUFFER_SIZE // OLED_WIDTH
+FLAG_PACKBITS = 0x01
+FLAG_ACK = 0x80
+ACK_PACKET = struct.Struct('<BBBHIHH')
+
+def packbits_encode(data, limit=None):
+    """PackBits-encode data; return None if the result would exceed limit bytes.
+
+    Runs of 3 or more equal bytes become (1 - n, byte) pairs, everything
+    else is copied as literals of up to 128 bytes behind an (n - 1) header.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    size = len(data)
+    limit = size + size // 128 + 1 if limit is None else limit
+    if not size:
+        return b''
+
+    # Start offset and length of every run of equal bytes
+    starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+    lengths = np.diff(np.append(starts, size))
+    raw = data.tobytes()
+    out = bytearray()
+    literal_start = 0
+
+    def flush_literal(start, end):
+        for chunk in range(start, end, 128):
+            chunk_end = min(chunk + 128, end)
+            out.append(chunk_end - chunk - 1)
+            out.extend(raw[chunk:chunk_end])
+
+    for start, length in zip(starts.tolist(), lengths.tolist()):
+        if length < 3:
+            continue
+        flush_literal(literal_start, start)
+        end = start + length
+        while end - start >= 3:
+            count = min(end - start, 128)
+            out.append(257 - count)
+            out.append(raw[start])
+            start += count
+        # One or two bytes left over from a long run join the next literal
+        literal_start = start
+        if len(out) > limit:
+            return None
+
+    flush_literal(literal_start, size)
+    return bytes(out) if len(out) <= limit else None
+
+def packbits_decode(data, size=None):
+    """Decode PackBits data, optionally checking it yields exactly size bytes."""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        header = data[i]
+        i += 1
+        if header < 128:
+            out += data[i:i + header + 1]
+            i += header + 1
+        elif header > 128:
+            out += bytes(data[i:i + 1]) * (257 - header)
+            i += 1
+    if size is not None and len(out) != size:
+        raise ValueError('Decoded size does not match')
+    return bytes(out)
+
+def build_page_packet(frame, page_mask, sequence, flags=0, compress=False):
+    """Build a versioned packet carrying the pages set in page_mask.
+
+    With compress, the pages are PackBits-encoded when that is smaller. A
+    packet of exactly 1024 bytes would be taken for a legacy raw frame, so
+    a compressed payload that lands on that size is sent raw instead.
+    """
+    pages = np.frombuffer(frame, dtype=np.uint8, count=OLED_BUFFER_SIZE).reshape(OLED_PAGES, OLED_WIDTH)
+    selected = [(page_mask >> page) & 1 for page in range(OLED_PAGES)]
+    payload = pages[np.flatnonzero(selected)].tobytes()
+    if compress:
+        packed = packbits_encode(payload, limit=len(payload) - 1)
+        if packed is not None and PACKET_HEADER.size + len(packed) != OLED_BUFFER_SIZE:
+            payload = packed
+            flags |= FLAG_PACKBITS
+    header = PACKET_HEADER.pack(PACKET_MAGIC, PROTOCOL_VERSION, flags, sequence & 0xFFFF, page_mask)
+    return header + payload
+
+def parse_page_packet(packet, frame):
+    """Apply a packet to a 1024-byte bytearray frame, return (sequence, page mask).
+
+    Legacy 1024-byte packets replace the whole frame and report sequence None.
+    """
+    if len(packet) == OLED_BUFFER_SIZE:
+        frame[:] = packet
+        return None, (1 << OLED_PAGES) - 1
+
+    if len(packet) < PACKET_HEADER.size:
+        raise ValueError('Packet too short')
+    magic, version, flags, sequence, page_mask = PACKET_HEADER.unpack_from(packet)
+    if magic != PACKET_MAGIC or version != PROTOCOL_VERSION:
+        raise ValueError('Unknown packet format')
+
+    pages = [page for page in range(OLED_PAGES) if page_mask >> page & 1]
+    payload = bytes(packet[PACKET_HEADER.size:])
+    if flags & FLAG_PACKBITS:
+        payload = packbits_decode(payload)
+    if len(payload) != len(pages) * OLED_WIDTH:
+        raise ValueError('Packet size does not match page mask')
+
+    offset = 0
+    for page in pages:
+        frame[page * OLED_WIDTH:(page + 1) * OLED_WIDTH] = payload[offset:offset + OLED_WIDTH]
+        offset += OLED_WIDTH
+    return sequence, page_mask
+
+def parse_ack(packet):
+    """Parse a display ack into a dict, or return None for anything else."""
+    if len(packet) != ACK_PACKET.size:
+        return None
+    magic, version, flags, sequence, render_us, gap_ms, rejected = ACK_PACKET.unpack(packet)
+    if magic != PACKET_MAGIC or version != PROTOCOL_VERSION or not flags & FLAG_ACK:
+        return None
+    return {'sequence': sequence, 'render_ms': render_us / 1000, 'gap_ms': gap_ms, 'rejected': rejected}
+
+class RateController:
+    """Adapt the frame rate sent to one display to what it acknowledges.
+
+    Every window seconds the acks received are compared with the frames
+    sent. When the share that went missing exceeds the link's usual loss by
+    more than 1 - min_ratio, the display is taken to be falling behind and
+    the rate backs off to 80% (or the achieved rate, if lower); otherwise it
+    climbs back towards the requested FPS by 10% a window. If backing off
+    did not reduce the loss, the loss is the Wi-Fi link's own and becomes the
+    new baseline, and the old rate is restored. The rate never exceeds what
+    the display's reported render time allows. Displays that never ack
+    (older firmware) are sent every frame.
+    """
+
+    def __init__(self, window=1.0, min_fps=1.0, min_ratio=0.9):
+        self.window = window
+        self.min_fps = min_fps
+        self.min_ratio = min_ratio
+        self.fps = None
+        self.credit = 1.0
+        self.last_offer = None
+        self.window_start = time.monotonic()
+        self.sent = 0
+        self.acked = 0
+        self.acks = 0
+        self.achieved_fps = None
+        self.requested_fps = None
+        self.ack = None
+        self.link_loss = 0.0
+        self.backoff = None
+
+    def allow(self, now):
+        """Token bucket: whether a frame offered at now may go out."""
+        if self.fps is None:
+            return True
+        if self.last_offer is not None:
+            self.credit = min(1.0, self.credit + (now - self.last_offer) * self.fps)
+        self.last_offer = now
+        # Half a token of slack so tick jitter does not skip frames at full rate
+        if self.credit < 0.5:
+            return False
+        self.credit -= 1.0
+        return True
+
+    def on_send(self):
+        self.sent += 1
+
+    def on_ack(self, ack):
+        self.ack = ack
+        self.acked += 1
+        self.acks += 1
+
+    def update(self, now, requested_fps):
+        """Close the window if it is over and pick the rate for the next one."""
+        self.requested_fps = requested_fps
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return
+        if self.acks:
+            self.achieved_fps = self.acked / elapsed
+            rate = requested_fps if self.fps is None else self.fps
+            # One frame of slack for acks still in flight at the window edge
+            loss = max(0.0, 1 - (self.acked + 1) / self.sent) if self.sent else 0.0
+
+            if self.backoff is not None:
+                previous_rate, previous_loss = self.backoff
+                self.backoff = None
+                if loss > previous_loss * 0.75:
+                    self.link_loss = loss
+                    rate = previous_rate
+            elif loss < self.link_loss:
+                self.link_loss = 0.8 * self.link_loss + 0.2 * loss
+
+            if loss > self.link_loss + (1 - self.min_ratio):
+                self.backoff = (rate, loss)
+                rate = min(rate * 0.8, self.achieved_fps / (1 - self.link_loss))
+            else:
+                rate = rate * 1.1
+            if self.ack['render_ms'] > 0:
+                rate = min(rate, 1000 / self.ack['render_ms'])
+            self.fps = max(self.min_fps, min(rate, requested_fps))
+        self.window_start = now
+        self.sent = self.acked = 0
+
+    def stats(self):
+        ack = self.ack or {}
+        return {
+            'requested_fps': self.requested_fps,
+            'rate_fps': round(self.fps, 2) if self.fps is not None else None,
+            'achieved_fps': round(self.achieved_fps, 2) if self.achieved_fps is not None else None,
+            'acks': self.acks,
+            'acked_sequence': ack.get('sequence'),
+            'render_ms': ack.get('render_ms'),
+            'device_gap_ms': ack.get('gap_ms'),
+            'device_rejected': ack.get('rejected'),
+            'link_loss': round(self.link_loss, 3),
+        }
+
+class DatagramEndpoint(asyncio.DatagramProtocol):
+    """Socket-like face of an asyncio UDP transport, for FrameSender.
+
+    sendto() hands the datagram to the transport and never blocks. Received
+    datagrams (display acks) are buffered for recvfrom(), which raises
+    BlockingIOError once they are used up. Only use it on the loop thread.
+    """
+
+    def __init__(self, backlog=256):
+        self.transport = None
+        self.received = deque(maxlen=backlog)
+        self.last_error = None
+
+    @classmethod
+    async def open(cls, local_addr=('0.0.0.0', 0)):
+        loop = asyncio.get_running_loop()
+        _, endpoint = await loop.create_datagram_endpoint(cls, local_addr=local_addr)
+        return endpoint
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received.append((data, addr))
+
+    def error_received(self, exc):
+        # e.g. ICMP port unreachable for a display that is offline
+        self.last_error = exc
+
+    def sendto(self, data, addr):
+        self.transport.sendto(memoryview(data), addr)
+
+    def recvfrom(self, bufsize):
+        if not self.received:
+            raise BlockingIOError('No datagram pending')
+        data, addr = self.received.popleft()
+        return data[:bufsize], addr
+
+    def close(self):
+        self.transport.close()
+
+def parse_target(value):
+    """Parse a target given as "ip", "ip:port" or {ip, port} into an address tuple."""
+    if isinstance(value, dict):
+        return (value['ip'], int(value.get('port', OLED_PORT)))
+    host, _, port = str(value).strip().partition(':')
+    if not host:
+        raise ValueError('Target IP is empty')
+    return (host, int(port) if port else OLED_PORT)
+
+class FrameSender:
+    """Send OLED frames to any number of targets over one non-blocking UDP socket.
+
+    With the 'delta' protocol only pages that changed since the previous
+    frame to a target go on the wire, and every keyframe_interval seconds all
+    image pages are resent so a display recovers from lost datagrams. With
+    compress, each packet is PackBits-encoded when that makes it smaller. The
+    'raw' protocol sends the legacy 1024-byte frame. Each target keeps its own
+    last frame, sequence number and send statistics.
+
+    Acks from the displays arrive on the same socket and are read by
+    poll_acks(). With adaptive, each target gets a RateController and frames
+    beyond the rate it keeps up with are skipped for that target only, except
+    for targets sent together with send_together() (a video wall's tiles),
+    which are all skipped at the rate of the slowest.
+
+    sock may also be a DatagramEndpoint, in which case the sender must be
+    used from the event loop thread.
+    """
+
+    def __init__(self, sock=None, protocol='delta', layout='split', keyframe_interval=2.0, compress=True,
+                 adaptive=False):
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if isinstance(sock, socket.socket):
+            sock.setblocking(False)
+        self.sock = sock
+        self.protocol = protocol
+        self.layout = layout
+        self.keyframe_interval = keyframe_interval
+        self.compress = compress
+        self.adaptive = adaptive
+        self.targets = {}
+
+    def _state(self, addr):
+        state = self.targets.get(addr)
+        if state is None:
+            state = self.targets[addr] = {
+                'last': OledFrame(self.layout),
+                'sequence': 0,
+                'keyframe_time': None,
+                'frames_sent': 0,
+                'bytes_sent': 0,
+                'send_errors': 0,
+                'last_error': None,
+                'send_latency_ms': 0.0,
+                'frames_throttled': 0,
+                'rate': RateController(),
+            }
+        return state
+
+    def _packet(self, pages, state, force_full):
+        """Build the datagram for one target, or None when nothing changed."""
+        if self.protocol == 'raw':
+            return pages.reshape(-1)
+
+        now = time.monotonic()
+        keyframe_time = state['keyframe_time']
+        # The firmware draws its own status bar, so only image pages are ever sent
+        if force_full or keyframe_time is None or now - keyframe_time >= self.keyframe_interval:
+            page_mask = state['last'].image_mask
+            state['keyframe_time'] = now
+        else:
+            page_mask = state['last'].dirty_mask(pages)
+        if not page_mask:
+            return None
+        return build_page_packet(pages, page_mask, state['sequence'], compress=self.compress)
+
+    def send(self, frame, addr, force_full=False, throttle=True):
+        """Send frame to addr, return the bytes put on the wire."""
+        pages = np.frombuffer(frame, dtype=np.uint8, count=OLED_BUFFER_SIZE).reshape(OLED_PAGES, OLED_WIDTH)
+        state = self._state(addr)
+        if self.adaptive and throttle and not force_full and not state['rate'].allow(time.monotonic()):
+            state['frames_throttled'] += 1
+            return 0
+        packet = self._packet(pages, state, force_full)
+        if packet is None:
+            return 0
+
+        start = time.perf_counter()
+        try:
+            self.sock.sendto(packet, addr)
+        except OSError as e:  # includes BlockingIOError when the send buffer is full
+            state['send_errors'] += 1
+            state['last_error'] = str(e)
+            return 0
+        state['send_latency_ms'] = (time.perf_counter() - start) * 1000
+
+        state['last'].pages[:] = pages
+        state['sequence'] = (state['sequence'] + 1) & 0xFFFF
+        state['frames_sent'] += 1
+        state['bytes_sent'] += len(packet)
+        state['rate'].on_send()
+        return len(packet)
+
+    def send_all(self, frame, addrs, force_full=False):
+        """Send one frame to every target, return the total bytes sent."""
+        return sum(self.send(frame, addr, force_full) for addr in addrs)
+
+    def send_together(self, frames, addrs, force_full=False):
+        """Send frames[i] to addrs[i] as one unit, return the total bytes sent.
+
+        With adaptive, the slowest target's RateController decides for all of
+        them, so either every tile of a video wall is updated or none is.
+        """
+        states = [self._state(addr) for addr in addrs]
+        if self.adaptive and not force_full:
+            rates = [state['rate'] for state in states if state['rate'].fps is not None]
+            if rates and not min(rates, key=lambda rate: rate.fps).allow(time.monotonic()):
+                for state in states:
+                    state['frames_throttled'] += 1
+                return 0
+        return sum(self.send(frame, addr, force_full, throttle=False) for frame, addr in zip(frames, addrs))
+
+    def poll_acks(self, requested_fps=None):
+        """Read every pending ack and, given the requested FPS, update the target rates."""
+        while True:
+            try:
+                packet, addr = self.sock.recvfrom(64)
+            except OSError:  # BlockingIOError once drained, or not bound yet
+                break
+            ack = parse_ack(packet)
+            state = self.targets.get(addr)
+            if ack is not None and state is not None:
+                state['rate'].on_ack(ack)
+
+        if requested_fps is not None:
+            now = time.monotonic()
+            for state in list(self.targets.values()):
+                state['rate'].update(now, requested_fps)
+
+    def stats(self):
+        """Per-target send and feedback statistics keyed by "ip:port"."""
+        return {
+            f'{host}:{port}': dict(
+                {key: value for key, value in state.items() if key not in ('last', 'rate')},
+                **state['rate'].stats(),
+            )
+            for (host, port), state in list(self.targets.items())
+        }
+
+    def reset(self, addr=None):
+        """Forget the last frame for one target (or all), forcing a full resend."""
+        if addr is None:
+            self.targets.clear()
+        else:
+            self.targets.pop(addr, None)
+
+    def close(self):
+        self.sock.close()
+
+class ChangeDetector:
+    """Cheap check for whether a captured frame differs from the previous one.
+
+    Compares the capture's integer box reduction (GrayscaleConverter.reduce),
+    which the resample needs anyway and which is still finer than the
+    output, so any change that can reach a display pixel is seen while a
+    static screen skips the resample, dither, pack and send at no extra
+    cost. A frame counts as changed when any reduced channel moved by more
+    than tolerance.
+    """
+
+    def __init__(self, tolerance=0):
+        self.tolerance = tolerance
+        self.previous = None
+
+    def changed(self, reduced):
+        sample = np.asarray(reduced)
+        if self.previous is None or self.previous.shape != sample.shape:
+            self.previous = sample
+            return True
+        if self.tolerance:
+            same = np.abs(sample.astype(np.int16) - self.previous).max() <= self.tolerance
+        else:
+            same = np.array_equal(sample, self.previous)
+        if same:
+            return False
+        self.previous = sample
+        return True
+
+    def reset(self):
+        self.previous = None
+
+class FrameHub:
+    """Broadcast the latest frame to any number of preview subscribers.
+
+    Frames are framed once at publish time and the same bytes are shared by
+    every subscriber. There is no backlog: a slow subscriber skips straight
+    to the newest frame. publish() and subscribe() run on the stream event
+    loop, so a subscriber is a coroutine rather than a thread.
+    """
+
+    def __init__(self, framing=bytes):
+        self.framing = framing
+        self.chunk = None
+        self.generation = 0
+        self.subscribers = 0
+        # Set by the next publish(); replaced each time so every waiter wakes once
+        self.published = None
+
+    def publish(self, payload):
+        self.chunk = self.framing(payload)
+        self.generation += 1
+        published, self.published = self.published, None
+        if published is not None:
+            published.set()
+
+    def clear(self):
+        self.chunk = None
+
+    async def subscribe(self, active, timeout=1.0):
+        """Yield each new chunk for as long as active() returns true."""
+        self.subscribers += 1
+        # Start with the current frame so a new tab is not blank until the next one
+        seen = self.generation - 1 if self.chunk is not None else self.generation
+        try:
+            while active():
+                if self.generation == seen or self.chunk is None:
+                    if self.published is None:
+                        self.published = asyncio.Event()
+                    try:
+                        await asyncio.wait_for(self.published.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                seen = self.generation
+                yield self.chunk
+        finally:
+            self.subscribers -= 1
+
+def mjpeg_part(jpeg):
+    """Frame a JPEG as one part of a multipart/x-mixed-replace stream."""
+    header = f'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n'
+    return header.encode() + jpeg + b'\r\n'
+
+# Preview channels: MJPEG of the capture and the raw OLED buffer sent to the display
+preview_hub = FrameHub(mjpeg_part)
+oled_hub = FrameHub()
+
+def encode_preview(image, max_size=(320, 180), quality=50, bgr=False):
+    """Downscale image to fit max_size and encode it as a JPEG thumbnail.
+
+    With bgr, image is a bgra_view() and its bands are swapped back after
+    downscaling, so only the thumbnail is copied.
+    """
+    scale = min(max_size[0] / image.width, max_size[1] / image.height, 1.0)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    if size != image.size:
+        # reducing_gap shrinks by an integer factor first, then filters the small image
+        image = image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    if bgr:
+        image = Image.merge('RGB', image.split()[2::-1])
     
-    return bytes(buffer)
+    img_jpeg = io.BytesIO()
+    image.save(img_jpeg, 'JPEG', quality=quality)
+    return img_jpeg.getvalue()
+
+class FrameSource(ABC):
+    """Where captured frames come from.
+
+    grab() returns an object shaped like an mss ScreenShot: .size is
+    (width, height), and .bgra and .raw hold the BGRA pixels. A source may
+    also set .oled to a ready 1024-byte buffer, in which case the stream sends
+    it as-is. Sources are used from a single thread and closed when done.
+    """
+
+    @abstractmethod
+    def grab(self, monitor_index=None, region=None):
+        """Return the next frame."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ScreenSource(FrameSource):
+    """Live screen capture through mss (monitor 1 and the full screen by default)."""
+
+    def __init__(self, monitor_index=1, region=None):
+        self.monitor_index = monitor_index
+        self.region = region
+        self.sct = mss.mss()
+
+    def grab(self, monitor_index=None, region=None):
+        if monitor_index is None:
+            monitor_index, region = self.monitor_index, self.region
+        return self.sct.grab(capture_rect(self.sct, monitor_index, region))
+
+    def close(self):
+        self.sct.close()
+
+# Recording file: a 24-byte header followed by fixed-size records of
+# (float64 capture time, frame bytes). 'bgra' records hold raw captures,
+# 'oled' records hold packed 1024-byte display buffers.
+RECORDING_MAGIC = b'OLEDREC1'
+RECORDING_HEADER = struct.Struct('<8sB3xIII')
+RECORDING_KINDS = ('bgra', 'oled')
+
+def recording_dtype(frame_size):
+    """numpy dtype of one recorded frame: a float64 timestamp, then the frame bytes."""
+    return np.dtype([('time', '<f8'), ('data', np.uint8, frame_size)])
+
+class FrameRecorder:
+    """Append captured frames or OLED buffers to a recording file."""
+
+    def __init__(self, path, kind='bgra'):
+        if kind not in RECORDING_KINDS:
+            raise ValueError(f'Unknown recording kind: {kind}')
+        self.path = path
+        self.kind = kind
+        self.file = None
+        self.frame_size = None
+        self.frames = 0
+
+    def write(self, frame, size=None, timestamp=None):
+        """Append one frame; every frame of a recording must have the same size."""
+        data = memoryview(frame).cast('B')
+        if self.file is None:
+            width, height = size or (OLED_WIDTH, 64)
+            self.frame_size = len(data)
+            self.file = open(self.path, 'wb')
+            self.file.write(RECORDING_HEADER.pack(
+                RECORDING_MAGIC, RECORDING_KINDS.index(self.kind), width, height, self.frame_size))
+        elif len(data) != self.frame_size:
+            raise ValueError('Frame size changed during recording')
+
+        self.file.write(struct.pack('<d', time.monotonic() if timestamp is None else timestamp))
+        self.file.write(data)
+        self.frames += 1
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+class RecordedFrame:
+    """A replayed frame; pixel data are views into the memory-mapped recording."""
+
+    def __init__(self, kind, size, data):
+        self.size = size
+        self.raw = self.bgra = data
+        self.oled = data if kind == 'oled' else None
+
+class ReplaySource(FrameSource):
+    """Replay a recording from a memory-mapped file.
+
+    With realtime the original frame timing is reproduced. Otherwise frames
+    come as fast as they are asked for, which measures the maximum
+    throughput of everything downstream.
+    """
+
+    def __init__(self, path, realtime=True, loop=True):
+        with open(path, 'rb') as f:
+            magic, kind, width, height, frame_size = RECORDING_HEADER.unpack(f.read(RECORDING_HEADER.size))
+        if magic != RECORDING_MAGIC:
+            raise ValueError(f'{path} is not a frame recording')
+        self.kind = RECORDING_KINDS[kind]
+        self.size = (width, height)
+        self.records = np.memmap(path, dtype=recording_dtype(frame_size), mode='r', offset=RECORDING_HEADER.size)
+        if not len(self.records):
+            raise ValueError(f'{path} has no frames')
+        self.realtime = realtime
+        self.loop = loop
+        self.index = 0
+        self.start = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def grab(self, monitor_index=None, region=None):
+        if self.index >= len(self.records):
+            if not self.loop:
+                raise EOFError('End of recording')
+            self.index = 0
+            self.start = None
+
+        record = self.records[self.index]
+        if self.realtime:
+            now = time.monotonic()
+            if self.start is None:
+                self.start = now - record['time']
+            delay = self.start + record['time'] - now
+            if delay > 0:
+                time.sleep(delay)
+        self.index += 1
+        return RecordedFrame(self.kind, self.size, record['data'])
+
+    def close(self):
+        self.records = None
+
+CLIP_MAX_FRAMES = 3000
+
+class Clip:
+    """An animation converted once into packed OLED frames, each with its own duration."""
+
+    def __init__(self, key, frames, durations):
+        self.key = key
+        self.frames = frames
+        self.durations = durations
+        self.nbytes = sum(len(frame) for frame in frames)
+
+    def info(self):
+        return {
+            'id': self.key,
+            'frames': len(self.frames),
+            'duration': round(sum(self.durations), 3),
+            'bytes': self.nbytes,
+        }
+
+def clip_frames(data):
+    """Yield (image or packed frame, duration in seconds or None) from an uploaded clip.
+
+    Frame recordings yield their captures (or already packed OLED frames)
+    timed by the recorded timestamps. Anything PIL opens yields its frames
+    (one for a still image) with the duration stored in the file.
+    """
+    if bytes(data[:len(RECORDING_MAGIC)]) == RECORDING_MAGIC:
+        magic, kind, width, height, frame_size = RECORDING_HEADER.unpack_from(data)
+        dtype = recording_dtype(frame_size)
+        count = (len(data) - RECORDING_HEADER.size) // dtype.itemsize
+        records = np.frombuffer(data, dtype=dtype, count=count, offset=RECORDING_HEADER.size)
+        times = records['time']
+        for i, record in enumerate(records):
+            duration = float(times[i + 1] - times[i]) if i + 1 < count else None
+            if RECORDING_KINDS[kind] == 'oled':
+                frame = OledFrame()
+                frame.pages.reshape(-1)[:] = record['data']
+                yield frame, duration
+            else:
+                yield RecordedFrame('bgra', (width, height), record['data']), duration
+        return
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except OSError:
+        raise ValueError('Not an image, animation or frame recording')
+    for frame in ImageSequence.Iterator(image):
+        duration = frame.info.get('duration')
+        yield frame.convert('RGB'), duration / 1000 if duration else None
+
+def convert_clip(data, dither='floyd-steinberg', resample='lanczos', frame_duration=0.1, key=None):
+    """Convert a whole clip into a Clip of packed OLED frames.
+
+    Frames without a duration of their own last frame_duration seconds.
+    """
+    converter = GrayscaleConverter(resample=resample)
+    frames, durations = [], []
+    for frame, duration in clip_frames(data):
+        if len(frames) == CLIP_MAX_FRAMES:
+            raise ValueError(f'Clip has more than {CLIP_MAX_FRAMES} frames')
+        if isinstance(frame, RecordedFrame):
+            frame = pack_for_oled(converter.convert(frame), dither)
+        elif not isinstance(frame, OledFrame):
+            frame = process_for_oled(frame, dither=dither, resample=resample)
+        frames.append(frame)
+        durations.append(duration if duration and duration > 0 else frame_duration)
+    if not frames:
+        raise ValueError('Clip has no frames')
+    return Clip(key, frames, durations)
+
+class ClipCache:
+    """Size-bounded LRU cache of converted clips.
 
-def screen_capture_thread(ip, fps, quality):
-    """Thread for continuous screen capture and streaming."""
-    with mss.mss() as sct:
-        # Get all monitors
-        monitors = sct.monitors
-        monitor = monitors[1]  # Primary monitor (index 1)
+    Clips are keyed by the SHA-256 of their content plus the processing
+    settings, so uploading the same clip with the same settings reuses the
+    packed frames. The least recently used clips are evicted once the packed
+    frames take more than max_bytes; the newest clip always stays.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.clips = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(data, dither, resample, frame_duration):
+        digest = hashlib.sha256(data).hexdigest()[:24]
+        return f'{digest}:{dither}:{resample}:{round(frame_duration * 1000)}'
+
+    def get(self, key):
+        """Return the cached clip for key (and mark it used), or None."""
+        with self.lock:
+            clip = self.clips.get(key)
+            if clip is not None:
+                self.clips.move_to_end(key)
+            return clip
+
+    def convert(self, data, dither='floyd-steinberg', resample='lanczos', frame_duration=0.1):
+        """Return (clip, whether it came from the cache), converting on a miss."""
+        key = self.key(data, dither, resample, frame_duration)
+        clip = self.get(key)
+        with self.lock:
+            if clip is not None:
+                self.hits += 1
+                return clip, True
+            self.misses += 1
+
+        # Converting takes a while, so it runs outside the lock
+        clip = convert_clip(data, dither, resample, frame_duration, key)
+        with self.lock:
+            if key not in self.clips:
+                self.clips[key] = clip
+                self.nbytes += clip.nbytes
+            while self.nbytes > self.max_bytes and len(self.clips) > 1:
+                _, old = self.clips.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.evictions += 1
+        return clip, False
+
+    def stats(self):
+        with self.lock:
+            return {
+                'clips': [clip.info() for clip in self.clips.values()],
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+clip_cache = ClipCache()
+
+class CapturedFrame:
+    """One grabbed screen frame plus the encodings derived from it."""
+
+    def __init__(self, generation, image, timestamp):
+        self.generation = generation
+        self.image = image
+        self.timestamp = timestamp
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, key, encoder):
+        """Return encoder(image), computed once per frame for each key."""
+        with self._lock:
+            if key not in self._encoded:
+                self._encoded[key] = encoder(self.image)
+            return self._encoded[key]
+
+class CaptureService:
+    """Long-lived screen grabber that owns one mss instance on its own thread.
+
+    Callers get the most recent frame for a (monitor, region) if it is
+    younger than the TTL. Otherwise they queue a grab, and every caller
+    waiting on the same key shares the result.
+    """
+
+    def __init__(self, ttl=0.05, max_regions=4, source_factory=ScreenSource):
+        self.ttl = ttl
+        self.source_factory = source_factory
+        self.max_regions = max_regions
+        self.condition = threading.Condition()
+        self.frames = {}
+        self.errors = {}
+        self.pending = set()
+        self.generation = 0
+        self.thread = None
+
+    def get(self, monitor_index=1, region=None, ttl=None, timeout=5.0):
+        """Return a CapturedFrame no older than ttl seconds."""
+        key = (monitor_index, region)
+        ttl = self.ttl if ttl is None else ttl
+        with self.condition:
+            frame = self.frames.get(key)
+            if frame is not None and time.monotonic() - frame.timestamp <= ttl:
+                return frame
+
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.pending.add(key)
+            self.condition.notify_all()
+            if not self.condition.wait_for(lambda: key not in self.pending, timeout):
+                raise TimeoutError('Screen capture timed out')
+
+            latest = self.frames.get(key)
+            if latest is None or latest is frame:
+                raise self.errors.get(key) or RuntimeError('Screen capture failed')
+            return latest
+
+    def _grab(self, source, key):
+        screenshot = source.grab(*key)
+        return Image.frombytes('RGB', screenshot.size, screenshot.bgra, 'raw', 'BGRX')
+
+    def _run(self):
+        try:
+            with self.source_factory() as source:
+                while True:
+                    with self.condition:
+                        self.condition.wait_for(lambda: self.pending)
+                        keys = list(self.pending)
+
+                    for key in keys:
+                        try:
+                            image, error = self._grab(source, key), None
+                        except Exception as e:
+                            image, error = None, e
+
+                        with self.condition:
+                            if error is None:
+                                self.generation += 1
+                                self.frames.pop(key, None)
+                                self.frames[key] = CapturedFrame(self.generation, image, time.monotonic())
+                                # Keep only the most recently grabbed regions
+                                while len(self.frames) > self.max_regions:
+                                    del self.frames[next(iter(self.frames))]
+                            else:
+                                self.errors[key] = error
+                            self.pending.discard(key)
+                            self.condition.notify_all()
+        except Exception as e:
+            # The source itself failed (e.g. no display): fail everyone waiting
+            with self.condition:
+                for key in self.pending:
+                    self.errors[key] = e
+                self.pending.clear()
+                self.condition.notify_all()
+
+capture_service = CaptureService()
+
+class FrameScheduler:
+    """Pace a loop to a target FPS with deadlines on the monotonic clock.
+
+    wait() sleeps until the next deadline instead of polling. Deadlines
+    advance by a fixed interval, so processing time does not cause drift.
+    When a frame overruns its slot, 'skip' drops the missed deadlines and
+    realigns to the next slot. 'catch-up' runs up to max_catch_up missed
+    frames back to back and drops the rest. The FPS can be changed while
+    the loop runs.
+    """
+
+    OVERRUN_POLICIES = ('skip', 'catch-up')
+
+    def __init__(self, fps, overrun='skip', max_catch_up=3):
+        if overrun not in self.OVERRUN_POLICIES:
+            raise ValueError(f'Unknown overrun policy: {overrun}')
+        self.lock = threading.Lock()
+        self.interval = 1.0 / fps
+        self.overrun = overrun
+        self.max_catch_up = max_catch_up
+        self.next_deadline = None
+        self.ticks = 0
+        self.missed_deadlines = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+
+    @property
+    def fps(self):
+        return 1.0 / self.interval
+
+    def set_fps(self, fps):
+        """Change the target FPS; a shorter interval takes effect at the next frame."""
+        if fps <= 0:
+            raise ValueError('FPS must be positive')
+        with self.lock:
+            self.interval = 1.0 / fps
+            if self.next_deadline is not None:
+                self.next_deadline = min(self.next_deadline, time.monotonic() + self.interval)
+
+    def wait(self, stop_event, interval=None):
+        """Sleep until the next deadline; return False if stop_event was set.
+
+        With interval, the frame about to run lasts that long instead of
+        1/fps (per-frame timing, e.g. for clips).
+        """
+        deadline = self._deadline()
+        delay = deadline - time.monotonic()
+        if delay > 0 and stop_event.wait(delay):
+            return False
+        self._advance(deadline, interval)
+        return not stop_event.is_set()
+
+    async def wait_async(self, stop_event, poll=0.1, interval=None):
+        """wait() for coroutines: sleeps on the event loop, checking stop_event every poll seconds."""
+        deadline = self._deadline()
+        while not stop_event.is_set():
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                self._advance(deadline, interval)
+                return not stop_event.is_set()
+            await asyncio.sleep(min(delay, poll))
+        return False
+
+    def _deadline(self):
+        with self.lock:
+            if self.next_deadline is None:
+                self.next_deadline = time.monotonic()
+            return self.next_deadline
+
+    def _advance(self, deadline, interval=None):
+        with self.lock:
+            interval = interval or self.interval
+            now = time.monotonic()
+            # A live FPS change may have moved the deadline while we slept
+            deadline = min(deadline, self.next_deadline)
+            jitter = max(0.0, now - deadline)
+            self.ticks += 1
+            self.jitter_total += jitter
+            self.jitter_max = max(self.jitter_max, jitter)
+
+            next_deadline = deadline + interval
+            behind = int((now - next_deadline) // interval) + 1 if next_deadline <= now else 0
+            if self.overrun == 'catch-up':
+                # Missed frames run back to back, up to max_catch_up of them
+                dropped = max(0, behind - self.max_catch_up)
+            else:
+                dropped = behind
+            self.missed_deadlines += dropped
+            self.next_deadline = next_deadline + dropped * interval
+
+    def stats(self):
+        with self.lock:
+            return {
+                'target_fps': round(self.fps, 2),
+                'overrun_policy': self.overrun,
+                'ticks': self.ticks,
+                'missed_deadlines': self.missed_deadlines,
+                'jitter_avg_ms': round(self.jitter_total / self.ticks * 1000, 3) if self.ticks else 0.0,
+                'jitter_max_ms': round(self.jitter_max * 1000, 3),
+            }
+
+PROTOCOLS = ('delta', 'raw')
+
+class StreamPipeline:
+    """The blocking half of a stream: capture, convert, dither, pack and encode.
+
+    Every call runs in one pipeline worker process (see PipelinePool), so
+    sources such as mss, which are tied to the thread that opened them, are
+    opened, used and closed there. With skip_static, frames whose capture matches the
+    previous one skip every later stage. A FrameRecorder records raw
+    captures or OLED buffers, depending on its kind.
+    """
+
+    def __init__(self, targets, quality, dither, source_factory, converter, wall=None, skip_static=True,
+                 preview_size=(320, 180), recorder=None, metrics=None):
+        self.targets = targets
+        self.quality = quality
+        self.dither = dither
+        self.source_factory = source_factory
+        self.converter = converter
+        self.wall = wall
+        self.skip_static = skip_static
+        self.preview_size = preview_size
+        self.recorder = recorder
+        self.metrics = pipeline_metrics if metrics is None else metrics
+        self.detector = ChangeDetector()
+        self.executor = None
+        self.source = None
+        self.screenshot = None
+        # (buffer, targets) pairs from the last processed frame
+        self.outputs = None
+
+    def open(self):
+        self.source = self.source_factory()
+        if self.wall:
+            self.executor = ThreadPoolExecutor(max_workers=min(len(self.wall.targets), os.cpu_count() or 1))
+
+    def step(self):
+        """Grab and process one frame.
+
+        Returns (kind, outputs, capture start) where kind is 'recorded' for a
+        replayed OLED buffer, 'static' for an unchanged capture (outputs are
+        then the previous ones) or 'processed'.
+        """
+        capture_start = time.perf_counter()
+        with self.metrics.time('grab'):
+            screenshot = self.source.grab()
+        if self.recorder and self.recorder.kind == 'bgra':
+            self.recorder.write(screenshot.raw, screenshot.size)
         
-        # UDP socket for sending
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Recorded OLED buffers skip processing and go straight to the sender
+        if getattr(screenshot, 'oled', None) is not None:
+            self.outputs = [(screenshot.oled, self.targets)]
+            return 'recorded', self.outputs, capture_start
         
-        last_frame_time = time.time()
-        frame_interval = 1.0 / fps
+        # Reduce straight from the capture buffer, and stop there when nothing changed
+        reduced = self.converter.reduce(screenshot, self.metrics)
+        if self.skip_static and not self.detector.changed(reduced) and self.outputs is not None:
+            return 'static', self.outputs, capture_start
         
-        while not stop_event.is_set():
+        self.screenshot = screenshot
+        canvas = self.converter.convert(screenshot, self.metrics, reduced)
+        
+        # Process for OLED
+        if self.wall:
+            tiles = pack_for_wall(canvas, self.wall, self.dither, self.executor, self.metrics)
+            self.outputs = [(tile, [addr]) for tile, addr in zip(tiles, self.wall.targets)]
+        else:
+            self.outputs = [(pack_for_oled(canvas, self.dither, metrics=self.metrics), self.targets)]
+        if self.recorder and self.recorder.kind == 'oled':
+            self.recorder.write(self.outputs[0][0])
+        return 'processed', self.outputs, capture_start
+
+    def preview(self):
+        """JPEG thumbnail of the last processed capture."""
+        with self.metrics.time('preview'):
+            return encode_preview(bgra_view(self.screenshot), self.preview_size, self.quality, bgr=True)
+
+    def close(self):
+        if self.recorder:
+            self.recorder.close()
+        if self.executor:
+            self.executor.shutdown()
+        if self.source:
+            self.source.close()
+
+class FrameRing:
+    """Ring of fixed-size frame slots in multiprocessing shared memory.
+
+    A slot holds the packed OLED buffers of one frame (one per wall tile)
+    and its JPEG preview behind a (generation, buffers, preview length)
+    header. Writers clear the generation before filling a slot and set it
+    last; readers check it on both sides of their copy, so a slot that is
+    overwritten meanwhile reads as None instead of a torn frame.
+    """
+
+    SLOT_HEADER = struct.Struct('<QII')
+
+    def __init__(self, slots, outputs, preview_bytes, name=None):
+        self.slots = slots
+        self.outputs = outputs
+        self.preview_bytes = preview_bytes
+        self.slot_size = self.SLOT_HEADER.size + outputs * OLED_BUFFER_SIZE + preview_bytes
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=slots * self.slot_size)
+
+    @property
+    def spec(self):
+        """Arguments that attach another process to this ring."""
+        return self.slots, self.outputs, self.preview_bytes, self.shm.name
+
+    def write(self, slot, generation, buffers, preview=b''):
+        buf = self.shm.buf
+        base = slot * self.slot_size
+        self.SLOT_HEADER.pack_into(buf, base, 0, 0, 0)
+        offset = base + self.SLOT_HEADER.size
+        for buffer in buffers:
+            buf[offset:offset + OLED_BUFFER_SIZE] = memoryview(buffer).cast('B')
+            offset += OLED_BUFFER_SIZE
+        if len(preview) > self.preview_bytes:
+            preview = b''  # an oversized thumbnail is skipped rather than truncated
+        offset = base + self.SLOT_HEADER.size + self.outputs * OLED_BUFFER_SIZE
+        buf[offset:offset + len(preview)] = preview
+        self.SLOT_HEADER.pack_into(buf, base, generation, len(buffers), len(preview))
+
+    def read(self, slot, generation):
+        """Return (buffers, preview) copied out of slot, or None if it no longer holds generation."""
+        buf = self.shm.buf
+        base = slot * self.slot_size
+        current, count, preview_length = self.SLOT_HEADER.unpack_from(buf, base)
+        if current != generation:
+            return None
+        offset = base + self.SLOT_HEADER.size
+        buffers = [bytes(buf[offset + i * OLED_BUFFER_SIZE:offset + (i + 1) * OLED_BUFFER_SIZE]) for i in range(count)]
+        offset += self.outputs * OLED_BUFFER_SIZE
+        preview = bytes(buf[offset:offset + preview_length])
+        if self.SLOT_HEADER.unpack_from(buf, base)[0] != generation:
+            return None
+        return buffers, preview
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+class StageLog:
+    """Stage timings collected in a worker process and replayed into pipeline_metrics by the parent."""
+
+    def __init__(self):
+        self.entries = []
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.entries.append((stage, time.perf_counter() - start))
+
+    def drain(self):
+        entries, self.entries = self.entries, []
+        return entries
+
+def pipeline_worker(conn, ring_spec, settings):
+    """Body of a pipeline worker process.
+
+    Builds a StreamPipeline from settings, then runs one step per
+    (generation, slot, preview wanted, tone) request from conn, publishes
+    the buffers and preview (only the preview for a static frame, when
+    wanted) into that ring slot and answers with
+    (kind, generation, capture start, stage timings or error). None or a
+    closed pipe ends the worker.
+    """
+    ring = FrameRing(*ring_spec)
+    log = StageLog()
+    pipeline = StreamPipeline(metrics=log, **settings)
+    try:
+        pipeline.open()
+    except Exception as e:
+        conn.send(('failed', 0, 0.0, str(e)))
+        ring.close()
+        return
+    conn.send(('ready', 0, 0.0, []))
+    
+    try:
+        while True:
+            request = conn.recv()
+            if request is None:
+                break
+            generation, slot, want_preview, tone = request
+            if tone != pipeline.converter.tone:
+                pipeline.converter.set_tone(**tone)
             try:
-                current_time = time.time()
-                if current_time - last_frame_time >= frame_interval:
-                    # Capture screen
-                    screenshot = sct.grab(monitor)
-                    
-                    # Convert to PIL Image
-                    img = Image.frombytes('RGB', screenshot.size, screenshot.bgra, 'raw', 'BGRX')
-                    
-                    # Process for OLED
-                    oled_buffer = process_for_oled(img)
-                    
-                    # Send to ESP32
-                    sock.sendto(oled_buffer, (ip, 8888))
-                    
-                    # Put in queue for web preview
-                    try:
-                        # Convert to JPEG for web preview
-                        img_jpeg = io.BytesIO()
-                        img.save(img_jpeg, 'JPEG', quality=quality)
-                        frame_queue.put(img_jpeg.getvalue(), block=False)
-                    except queue.Full:
-                        pass  # Skip if queue is full
-                    
-                    last_frame_time = current_time
-                
-                # Small sleep to prevent CPU overuse
-                time.sleep(0.001)
-                
+                kind, outputs, capture_start = pipeline.step()
+            except EOFError:
+                conn.send(('eof', generation, 0.0, log.drain()))
+                continue
             except Exception as e:
-                print(f"Screen capture error: {e}")
                 time.sleep(1)  # Wait before retrying
+                conn.send(('error', generation, 0.0, str(e)))
+                continue
+            if kind != 'static':
+                preview = pipeline.preview() if want_preview and kind == 'processed' else b''
+                ring.write(slot, generation, [buffer for buffer, _ in outputs], preview)
+            elif want_preview:
+                # The screen matches the last processed capture, so preview that
+                ring.write(slot, generation, [], pipeline.preview())
+            conn.send((kind, generation, capture_start, log.drain()))
+    except (EOFError, OSError):
+        pass  # The stream is gone
+    finally:
+        pipeline.close()
+        ring.close()
+
+class PipelinePool:
+    """StreamPipelines running in worker processes, publishing through a FrameRing.
+
+    Capture and processing run outside the web server's process, so request
+    handling and sends never compete with them for the GIL, and with several
+    workers consecutive frames are processed on separate cores. Each worker
+    runs one step at a time. A reader thread forwards the workers' small
+    replies to on_result on the event loop, which then copies the frame out
+    of its ring slot.
+    """
+
+    def __init__(self, settings, workers=1, on_result=None):
+        wall = settings.get('wall')
+        width, height = settings.get('preview_size', (320, 180))
+        self.ring = FrameRing(max(4, 2 * workers + 2), len(wall.targets) if wall else 1,
+                              width * height * 3 + 16384)
+        self.settings = settings
+        self.workers = workers
+        self.on_result = on_result
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = []
+        self.conns = []
+        self.idle = []
+        self.ready = None
+        self.idle_event = None
+        self.reader = None
+        self.loop = None
+        self.alive = 0
+        self.generation = 0
+
+    async def start(self, timeout=60):
+        """Start the workers and wait until each has opened its source."""
+        self.loop = asyncio.get_running_loop()
+        self.ready = self.loop.create_future()
+        self.idle_event = asyncio.Event()
+        for i in range(self.workers):
+            conn, child = self.context.Pipe()
+            process = self.context.Process(target=pipeline_worker, args=(child, self.ring.spec, self.settings),
+                                           name=f'pipeline-{i}', daemon=True)
+            await self.loop.run_in_executor(None, process.start)
+            child.close()
+            self.processes.append(process)
+            self.conns.append(conn)
+            self.alive += 1
+        self.reader = threading.Thread(target=self._read, name='pipeline-reader', daemon=True)
+        self.reader.start()
+        await asyncio.wait_for(self.ready, timeout)
+
+    def _read(self):
+        conns = list(self.conns)
+        while conns:
+            for conn in connection.wait(conns):
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    conns.remove(conn)
+                    message = ('exit', 0, 0.0, 'Pipeline worker exited')
+                self.loop.call_soon_threadsafe(self._on_message, conn, message)
+
+    def _on_message(self, conn, message):
+        kind = message[0]
+        if kind in ('failed', 'exit'):
+            if not self.ready.done():
+                self.ready.set_exception(RuntimeError(message[3]))
+            if kind == 'exit':
+                self.alive -= 1
+                if conn in self.idle:
+                    self.idle.remove(conn)
+                self.idle_event.set()  # wake submit() so it notices
+                if self.on_result:
+                    self.on_result(*message)
+            return
+        self.idle.append(conn)
+        self.idle_event.set()
+        if kind == 'ready':
+            if len(self.idle) == self.workers and not self.ready.done():
+                self.ready.set_result(None)
+        elif self.on_result:
+            self.on_result(*message)
+
+    async def submit(self, want_preview=False, tone=None):
+        """Hand the next frame to an idle worker (waiting for one), return its generation."""
+        while not self.idle:
+            if not self.alive:
+                raise RuntimeError('Every pipeline worker exited')
+            self.idle_event.clear()
+            await self.idle_event.wait()
+        conn = self.idle.pop(0)
+        self.generation += 1
+        conn.send((self.generation, self.generation % self.ring.slots, want_preview, tone))
+        return self.generation
+
+    def read(self, generation):
+        return self.ring.read(generation % self.ring.slots, generation)
+
+    def close(self, timeout=5):
+        """Stop the workers (blocking, so run it off the event loop) and free the ring."""
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self.reader:
+            self.reader.join(timeout)
+        for conn in self.conns:
+            conn.close()
+        self.ring.close(unlink=True)
+
+async def run_stream(targets, fps, quality, dither='floyd-steinberg', monitor_index=1, region=None,
+                     sender=None, skip_static=True, keepalive=1.0, wall=None,
+                     preview_fps=10, preview_size=(320, 180), scheduler=None, source_factory=None,
+                     recorder=None, converter=None, workers=1):
+    """Stream frames to the targets until stop_event is set.
+
+    Runs on the stream event loop. Capture and processing run in a
+    PipelinePool of worker processes while the loop paces frames, sends
+    them through the shared sender (a DatagramEndpoint when called from
+    /start_stream) and feeds the preview hubs; frames come back through a
+    shared-memory FrameRing. Every frame is captured and processed once,
+    then sent to all targets. With a VideoWall the capture is split into
+    tiles instead, one per wall target. Unchanged frames are not processed;
+    the last buffers are resent every keepalive seconds. The web preview is
+    only encoded while someone is subscribed, at most preview_fps times a
+    second and at thumbnail size. Frames are paced by a FrameScheduler and
+    converted with the settings of a GrayscaleConverter, which can be passed
+    in to change the FPS or tone while the stream runs.
+
+    Frames come from source_factory() (live capture of the selected monitor
+    region by default, or e.g. a ReplaySource), called in each worker, so
+    it must be picklable. With several workers, frames that finish after a
+    newer one was sent are dropped.
+    """
+    loop = asyncio.get_running_loop()
+    if source_factory is None:
+        # Grab only the selected region of the selected monitor
+        source_factory = functools.partial(ScreenSource, monitor_index, region)
+    if sender is None:
+        sender = FrameSender(await DatagramEndpoint.open())
+    if scheduler is None:
+        scheduler = FrameScheduler(fps)
+    if converter is None:
+        converter = GrayscaleConverter(*((wall.width, wall.height) if wall else (OLED_WIDTH, 48)))
+    
+    last_send_time = 0.0
+    last_preview_time = 0.0
+    preview_interval = 1.0 / preview_fps if preview_fps else 0.0
+    # Buffers of the newest frame sent, resent as keepalives
+    last = {'generation': 0, 'outputs': None}
+    # Set by the message that ended the stream ('eof', or 'exit' with its reason)
+    finished = None
+    
+    for key in stream_stats:
+        stream_stats[key] = 0
+    stream_snapshot.update(active=True, jpeg=None, time=0.0)
     
-    sock.close()
+    def publish_preview(preview):
+        preview_hub.publish(preview)
+        with snapshot_ready:
+            stream_snapshot.update(jpeg=preview, time=time.monotonic())
+            snapshot_ready.notify_all()
+    
+    def deliver(kind, generation, capture_start, payload):
+        """Send a frame a worker finished (called on the event loop)."""
+        global stream_error
+        nonlocal last_send_time, finished
+        if kind in ('eof', 'exit'):
+            finished = finished or (kind, payload)  # End of a non-looping replay, or a worker died
+            return
+        if kind == 'error':
+            print(f"Screen capture error: {payload}")
+            stream_error = payload
+            return
+        for stage, seconds in payload:
+            pipeline_metrics.stages[stage].observe(seconds)
+        
+        current_time = time.monotonic()
+        if kind == 'static':
+            stream_stats['frames_skipped'] += 1
+            # A preview wanted while the screen is static comes without buffers
+            frame = pool.read(generation)
+            if frame and frame[1]:
+                publish_preview(frame[1])
+            if keepalive and last['outputs'] and current_time - last_send_time >= keepalive:
+                for buffer, addrs in last['outputs']:
+                    sender.send_all(buffer, addrs, force_full=True)
+                stream_stats['keepalives_sent'] += 1
+                last_send_time = current_time
+            return
+        
+        frame = pool.read(generation) if generation > last['generation'] else None
+        if frame is None:
+            stream_stats['frames_late'] += 1
+            return
+        buffers, preview = frame
+        if wall:
+            outputs = [(buffer, [addr]) for buffer, addr in zip(buffers, wall.targets)]
+        else:
+            outputs = [(buffers[0], targets)]
+        
+        # Send to every ESP32 (only the changed pages with the delta protocol).
+        # All buffers are ready first, so a wall's tiles go out back to back,
+        # and they are throttled together so the wall never tears.
+        with pipeline_metrics.time('send'):
+            if wall:
+                sender.send_together(buffers, wall.targets)
+            else:
+                sender.send_all(buffers[0], targets)
+        last.update(generation=generation, outputs=outputs)
+        last_send_time = current_time
+        stream_stats['frames_processed'] += 1
+        if kind == 'recorded':
+            return
+        pipeline_metrics.latency.observe(time.perf_counter() - capture_start)
+        
+        # Publish for web preview and /capture (the OLED preview shows the first display)
+        oled_hub.publish(outputs[0][0])
+        if preview:
+            publish_preview(preview)
+    
+    pool = PipelinePool({
+        'targets': targets,
+        'quality': quality,
+        'dither': dither,
+        'source_factory': source_factory,
+        'converter': converter,
+        'wall': wall,
+        'skip_static': skip_static,
+        'preview_size': preview_size,
+        'recorder': recorder,
+    }, workers, deliver)
+    
+    try:
+        await pool.start()
+        while not finished and await scheduler.wait_async(stop_event):
+            current_time = time.monotonic()
+            # Display acks steer the per-target rates
+            sender.poll_acks(scheduler.fps)
+            want_preview = bool(preview_hub.subscribers) and current_time - last_preview_time >= preview_interval
+            if want_preview:
+                last_preview_time = current_time
+            elif snapshot_wanted.is_set():
+                snapshot_wanted.clear()
+                want_preview = True
+            await pool.submit(want_preview, converter.tone)
+        if finished and finished[0] == 'exit' and not stop_event.is_set():
+            raise RuntimeError(finished[1])
+    finally:
+        stream_snapshot['active'] = False
+        await loop.run_in_executor(None, pool.close)
+        sender.close()
+
+async def play_clip(clip, targets, sender=None, scheduler=None, loop=True):
+    """Play a converted Clip to the targets until stop_event is set.
+
+    Runs on the stream event loop like run_stream. The frames were packed
+    when the clip was converted, so each tick only reads acks and sends;
+    the scheduler gives every frame its own duration. Without loop the clip
+    plays once.
+    """
+    if sender is None:
+        sender = FrameSender(await DatagramEndpoint.open())
+    if scheduler is None:
+        scheduler = FrameScheduler(1 / clip.durations[0])
+    
+    for key in stream_stats:
+        stream_stats[key] = 0
+    
+    try:
+        while True:
+            for frame, duration in zip(clip.frames, clip.durations):
+                if not await scheduler.wait_async(stop_event, interval=duration):
+                    return
+                sender.poll_acks(1 / duration)
+                with pipeline_metrics.time('send'):
+                    sender.send_all(frame, targets)
+                stream_stats['frames_processed'] += 1
+                oled_hub.publish(frame)
+            if not loop:
+                return
+    finally:
+        sender.close()
+
+class StreamCore:
+    """The asyncio event loop behind streaming.
+
+    The loop runs in its own thread, started on first use, and Flask
+    handlers hand it coroutines with submit(). The stream, its UDP endpoint,
+    the preview hubs and the preview feed server (serve_feed) all live on
+    it, so preview clients and targets cost a coroutine or a dict entry
+    instead of a thread each.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name='stream-loop', daemon=True)
+                self.thread.start()
+        return self.loop
+
+    def submit(self, coro):
+        """Schedule coro on the loop and return its concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.start())
+
+stream_core = StreamCore()
+
+def stream_done(future):
+    """Done callback of stream_future: clear streaming and keep the error that ended it."""
+    global streaming, stream_error
+    if future is not stream_future:
+        return  # An older stream, already replaced
+    if not future.cancelled() and future.exception() is not None:
+        error = future.exception()
+        stream_error = str(error) or type(error).__name__
+        print(f"Stream stopped: {stream_error}")
+    streaming = False
 
 @app.route('/')
 def home():
     return HTML_TEMPLATE
 
+def stream_preview(max_age=1.0, timeout=1.0):
+    """Preview JPEG of the running stream, asking its workers for a new one if it is older than max_age."""
+    with snapshot_ready:
+        if time.monotonic() - stream_snapshot['time'] > max_age:
+            since = time.monotonic()
+            snapshot_wanted.set()
+            # A static screen sends no new preview, so the last one stays valid
+            snapshot_ready.wait_for(lambda: stream_snapshot['time'] >= since, timeout)
+        return stream_snapshot['jpeg']
+
 @app.route('/capture')
 def capture():
-    """Capture a single screen frame."""
+    """Capture a single screen frame.
+
+    Served from the shared capture service, so requests within its TTL reuse
+    one grab and one encode. ?format=oled returns the 1024-byte OLED buffer
+    (resized with ?resample= and dithered with ?dither=) instead of a JPEG.
+
+    While a stream runs, the frame comes from its workers instead of a grab
+    in this process: the buffer last sent to the first display, or the
+    stream's preview JPEG (at its preview_size). The stream's monitor,
+    region and processing settings apply then, not the query's.
+    """
+    try:
+        if request.args.get('format') == 'oled' and streaming and oled_hub.chunk is not None:
+            return Response(oled_hub.chunk, mimetype='application/octet-stream')
+        if request.args.get('format') != 'oled' and stream_snapshot['active']:
+            jpeg = stream_preview()
+            if jpeg:
+                return Response(jpeg, mimetype='image/jpeg')
+        
+        monitor_index = request.args.get('monitor', 1, type=int)
+        region = parse_region(request.args.get('region'))
+        frame = capture_service.get(monitor_index, region)
+
+        if request.args.get('format') == 'oled':
+            dither = request.args.get('dither', 'floyd-steinberg')
+            if dither not in DITHER_MODES:
+                raise ValueError(f'Unknown dither mode: {dither}')
+            resample = request.args.get('resample', 'lanczos')
+            if resample not in RESAMPLE_FILTERS:
+                raise ValueError(f'Unknown resample filter: {resample}')
+            buffer = frame.encoded(('oled', dither, resample),
+                                   lambda img: bytes(process_for_oled(img, dither=dither, resample=resample)))
+            return Response(buffer, mimetype='application/octet-stream')
+
+        jpeg = frame.encoded(('jpeg', 80), lambda img: encode_preview(img, img.size, 80))
+        return Response(jpeg, mimetype='image/jpeg')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/monitors')
+def list_monitors():
+    """List capturable monitors (index 0 is the combined virtual screen)."""
     try:
         with mss.mss() as sct:
-            monitors = sct.monitors
-            screenshot = sct.grab(monitors[1])  # Primary monitor
-            
-            # Convert to JPEG
-            img = Image.frombytes('RGB', screenshot.size, screenshot.bgra, 'raw', 'BGRX')
-            img_io = io.BytesIO()
-            img.save(img_io, 'JPEG', quality=80)
-            img_io.seek(0)
-            
-            return Response(img_io.getvalue(), mimetype='image/jpeg')
+            return jsonify({'monitors': [
+                {'index': i, 'left': m['left'], 'top': m['top'],
+                 'width': m['width'], 'height': m['height']}
+                for i, m in enumerate(sct.monitors)
+            ]})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# One UDP socket reused by every /send request instead of one per request
+request_sender = FrameSender(protocol='raw')
+request_sender_lock = threading.Lock()
+
+def request_targets():
+    """Targets of a binary request from ?ip= (repeatable) or the X-OLED-Target header."""
+    values = request.args.getlist('ip') or request.headers.get('X-OLED-Target', '').split(',')
+    return [parse_target(v) for v in values if v.strip()]
+
+def send_frames(frames, targets, interval=0.0):
+    """Send frames through the pooled sender, return the number that failed."""
+    failed = 0
+    for i, (frame, addr) in enumerate(zip(frames, targets)):
+        if i and interval:
+            time.sleep(interval)
+        with request_sender_lock:
+            if not request_sender.send(frame, addr):
+                failed += 1
+    return failed
+
 @app.route('/send', methods=['POST'])
 def send():
-    """Send a single frame to ESP32."""
+    """Send a single frame to ESP32.
+
+    Accepts JSON {ip, data: [1024 ints]} or a raw 1024-byte
+    application/octet-stream body with the target in ?ip= or X-OLED-Target.
+    """
     try:
-        req = request.json
-        ip = req.get('ip')
-        img_list = req.get('data')
+        if request.mimetype == 'application/octet-stream':
+            frame = request.get_data()
+            targets = request_targets()
+        else:
+            req = request.json
+            frame = bytes(req.get('data') or [])
+            targets = [parse_target(req['ip'])] if req.get('ip') else []
         
-        if not ip or len(img_list) != 1024:
+        if not targets or len(frame) != OLED_BUFFER_SIZE:
             return jsonify({'success': False, 'error': 'Invalid data'}), 400
 
-        # Create UDP socket and send
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(bytes(img_list), (ip, 8888))
-        sock.close()
-        
+        if send_frames([frame] * len(targets), targets):
+            return jsonify({'success': False, 'error': 'Send failed'}), 503
         return jsonify({'success': True})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/send_batch', methods=['POST'])
+def send_batch():
+    """Send many frames in one request.
+
+    The application/octet-stream body is a concatenation of 1024-byte
+    frames. With one target the frames are played to it in order,
+    interval_ms apart (an animation). With as many targets as frames, frame
+    i goes to target i.
+    """
+    try:
+        data = request.get_data()
+        targets = request_targets()
+        interval = request.args.get('interval_ms', 0, type=float) / 1000
+        
+        if not data or len(data) % OLED_BUFFER_SIZE:
+            return jsonify({'success': False, 'error': 'Body must be a multiple of 1024 bytes'}), 400
+        view = memoryview(data)
+        frames = [view[i:i + OLED_BUFFER_SIZE] for i in range(0, len(data), OLED_BUFFER_SIZE)]
+        if len(targets) == 1:
+            targets = targets * len(frames)
+        elif len(targets) != len(frames):
+            return jsonify({'success': False, 'error': 'Need one target or one target per frame'}), 400
+        
+        failed = send_frames(frames, targets, interval)
+        return jsonify({'success': not failed, 'sent': len(frames) - failed, 'failed': failed})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/start_stream', methods=['POST'])
 def start_stream():
     """Start continuous screen streaming."""
-    global streaming, stream_thread, stop_event
+    global streaming, stream_future, stream_error, stream_sender, stream_scheduler, stream_converter, stop_event
     
     if streaming:
         return jsonify({'success': False, 'error': 'Already streaming'}), 400
+    if stream_future and not stream_future.done():
+        return jsonify({'success': False, 'error': 'The previous stream is still stopping'}), 400
     
     try:
         req = request.json
-        ip = req.get('ip', '192.168.1.100')
+        # A list of targets shares one capture; 'ip' is kept for single displays
+        targets = [parse_target(t) for t in req.get('targets') or [req.get('ip', '192.168.1.100')]]
+        # A video wall splits the capture across its own per-tile targets
+        wall = VideoWall.from_config(req['wall']) if req.get('wall') else None
         fps = req.get('fps', 10)
         quality = req.get('quality', 50)
+        dither = req.get('dither', 'floyd-steinberg')
+        monitor_index = int(req.get('monitor', 1))
+        region = parse_region(req.get('region'))
+        protocol = req.get('protocol', 'delta')
+        compress = bool(req.get('compress', True))
+        adaptive = bool(req.get('adaptive', True))
+        skip_static = bool(req.get('skip_static', True))
+        keepalive = float(req.get('keepalive', 1.0))
+        preview_fps = float(req.get('preview_fps', 10))
+        preview_size = tuple(int(v) for v in req.get('preview_size', (320, 180)))
+        
+        workers = int(req.get('workers', 1))
+        
+        # Replay a recording instead of capturing the screen
+        source_factory = None
+        if req.get('replay') or replay_path:
+            path = req.get('replay') or replay_path
+            ReplaySource(path).close()  # fail here on a missing or invalid file
+            source_factory = functools.partial(ReplaySource, path, realtime=bool(req.get('realtime', True)),
+                                               loop=bool(req.get('loop', True)))
+        recorder = FrameRecorder(req['record'], req.get('record_kind', 'bgra')) if req.get('record') else None
+        # A recording is read or written in order, so only one worker may touch it
+        if source_factory or recorder:
+            workers = 1
+        
+        # Play a clip uploaded to /clips instead of streaming the screen
+        clip = None
+        if req.get('clip'):
+            clip = clip_cache.get(req['clip'])
+            if clip is None:
+                return jsonify({'success': False, 'error': 'Unknown clip, upload it again'}), 404
+            if wall:
+                return jsonify({'success': False, 'error': 'Clips cannot be played on a video wall'}), 400
+        
+        if dither not in DITHER_MODES:
+            return jsonify({'success': False, 'error': f'Unknown dither mode: {dither}'}), 400
+        if protocol not in PROTOCOLS:
+            return jsonify({'success': False, 'error': f'Unknown protocol: {protocol}'}), 400
+        if not 1 <= workers <= (os.cpu_count() or 1):
+            return jsonify({'success': False, 'error': f'Workers must be between 1 and {os.cpu_count() or 1}'}), 400
         
         # Reset stop event
         stop_event.clear()
-        
-        # Start capture thread
-        stream_thread = threading.Thread(
-            target=screen_capture_thread,
-            args=(ip, fps, quality),
-            daemon=True
+        # Sends (and display acks) go through an asyncio UDP endpoint on the stream loop
+        endpoint = stream_core.submit(DatagramEndpoint.open()).result(timeout=5)
+        stream_sender = FrameSender(endpoint, protocol=protocol, layout=wall.layout if wall else 'split', compress=compress,
+                                    adaptive=adaptive)
+        stream_scheduler = FrameScheduler(float(fps), req.get('overrun', 'skip'))
+        stream_converter = GrayscaleConverter(
+            *((wall.width, wall.height) if wall else (OLED_WIDTH, 48)),
+            gamma=float(req.get('gamma', 1.0)),
+            contrast=float(req.get('contrast', 1.0)),
+            invert=bool(req.get('invert', False)),
+            resample=req.get('resample', 'lanczos'),
         )
-        stream_thread.start()
         
+        # Start the stream (or the clip) on the event loop
+        if clip:
+            coroutine = play_clip(clip, targets, stream_sender, stream_scheduler, loop=bool(req.get('loop', True)))
+        else:
+            coroutine = run_stream(
+                targets, fps, quality, dither, monitor_index, region,
+                sender=stream_sender,
+                skip_static=skip_static,
+                keepalive=keepalive,
+                wall=wall,
+                preview_fps=preview_fps,
+                preview_size=preview_size,
+                scheduler=stream_scheduler,
+                converter=stream_converter,
+                source_factory=source_factory,
+                recorder=recorder,
+                workers=workers,
+            )
+        stream_error = None
         streaming = True
-        return jsonify({'success': True})
+        stream_future = stream_core.submit(coroutine)
+        stream_future.add_done_callback(stream_done)
+        return jsonify({'success': True, 'clip': clip.info()} if clip else {'success': True})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/stream_settings', methods=['POST'])
+def stream_settings():
+    """Change settings of the running stream without restarting it."""
+    if not streaming:
+        return jsonify({'success': False, 'error': 'Not streaming'}), 400
+    
+    try:
+        req = request.json
+        if 'fps' in req:
+            stream_scheduler.set_fps(float(req['fps']))
+        if {'gamma', 'contrast', 'invert'} & req.keys():
+            tone = dict(stream_converter.tone)
+            tone.update((key, req[key]) for key in tone if key in req)
+            stream_converter.set_tone(float(tone['gamma']), float(tone['contrast']), bool(tone['invert']))
+        return jsonify({'success': True, 'scheduler': stream_scheduler.stats(), 'tone': stream_converter.tone})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
 @app.route('/stop_stream', methods=['POST'])
 def stop_stream():
     """Stop screen streaming."""
@@ -696,55 +3193,259 @@ def stop_stream():
         return jsonify({'success': False, 'error': 'Not streaming'}), 400
     
     stop_event.set()
+    # Wait until the stream has closed its workers and sender, so a quick
+    # restart can't clear stop_event before this stream has seen it
+    try:
+        stream_future.exception(timeout=10)
+    except Exception:
+        stream_future.cancel()  # Still running after the timeout
     streaming = False
     
-    # Clear the frame queue
-    while not frame_queue.empty():
-        try:
-            frame_queue.get_nowait()
-        except:
-            pass
+    # Drop the last preview frames so new subscribers don't see a stale image
+    preview_hub.clear()
+    oled_hub.clear()
     
     return jsonify({'success': True})
 
-@app.route('/stream_feed')
-def stream_feed():
-    """SSE endpoint for streaming frames to web client."""
-    def generate():
-        while streaming:
-            try:
-                frame = frame_queue.get(timeout=1)
-                yield f"data: {frame.hex()}\n\n"
-            except queue.Empty:
-                yield ":keepalive\n\n"
-            except Exception:
-                break
+@app.route('/clips', methods=['GET', 'POST'])
+def clips():
+    """Upload a clip to convert (POST) or list the cached clips (GET).
+
+    The body is an animated GIF, APNG or WebP, a still image or a frame
+    recording, sent as application/octet-stream or as the 'file' field of a
+    form. ?dither= and ?resample= set the processing and ?fps= the timing of
+    frames that carry none. Play the returned id with /start_stream {clip}.
+    """
+    if request.method == 'GET':
+        return jsonify(clip_cache.stats())
     
-    return Response(
-        generate(),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no'
-        }
-    )
+    try:
+        upload = request.files.get('file')
+        data = upload.read() if upload else request.get_data()
+        dither = request.args.get('dither', 'floyd-steinberg')
+        resample = request.args.get('resample', 'lanczos')
+        fps = request.args.get('fps', 10, type=float)
+        
+        if not data:
+            return jsonify({'success': False, 'error': 'No clip uploaded'}), 400
+        if dither not in DITHER_MODES:
+            return jsonify({'success': False, 'error': f'Unknown dither mode: {dither}'}), 400
+        if resample not in RESAMPLE_FILTERS:
+            return jsonify({'success': False, 'error': f'Unknown resample filter: {resample}'}), 400
+        if not fps or fps <= 0:
+            return jsonify({'success': False, 'error': 'FPS must be positive'}), 400
+        
+        clip, cached = clip_cache.convert(data, dither, resample, 1 / fps)
+        return jsonify({'success': True, 'cached': cached, **clip.info()})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/status')
 def status():
     """Get streaming status."""
     return jsonify({
         'streaming': streaming,
-        'queue_size': frame_queue.qsize()
+        'error': stream_error,
+        'preview_subscribers': preview_hub.subscribers + oled_hub.subscribers,
+        **stream_stats,
+        'targets': stream_sender.stats() if stream_sender else {},
+        'scheduler': stream_scheduler.stats() if stream_scheduler else {}
     })
 
+def render_metrics():
+    """Render pipeline metrics in the Prometheus text exposition format."""
+    lines = [
+        '# HELP oled_stage_seconds Time spent in each frame pipeline stage.',
+        '# TYPE oled_stage_seconds histogram',
+    ]
+    for stage, hist in pipeline_metrics.stages.items():
+        with hist.lock:
+            counts, total, count = list(hist.counts), hist.total, hist.count
+        cumulative = 0
+        for bound, bucket in zip(hist.buckets, counts):
+            cumulative += bucket
+            lines.append(f'oled_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'oled_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(f'oled_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'oled_stage_seconds_count{{stage="{stage}"}} {count}')
+
+    latency = pipeline_metrics.latency
+    lines += [
+        '# HELP oled_frame_latency_seconds Capture-to-send latency of processed frames.',
+        '# TYPE oled_frame_latency_seconds summary',
+    ]
+    for quantile, value in latency.percentiles().items():
+        lines.append(f'oled_frame_latency_seconds{{quantile="{quantile}"}} {value}')
+    lines.append(f'oled_frame_latency_seconds_sum {latency.total}')
+    lines.append(f'oled_frame_latency_seconds_count {latency.count}')
+
+    for key, help_text in (
+        ('frames_processed', 'Frames captured and sent through the full pipeline.'),
+        ('frames_skipped', 'Frames skipped because the capture did not change.'),
+        ('keepalives_sent', 'Keepalive resends of the last frame.'),
+        ('frames_late', 'Frames dropped because a newer one from another worker was already sent.'),
+    ):
+        lines += [f'# HELP oled_{key}_total {help_text}', f'# TYPE oled_{key}_total counter',
+                  f'oled_{key}_total {stream_stats[key]}']
+
+    senders = {'stream': stream_sender, 'request': request_sender}
+    for key, help_text in (
+        ('frames_sent', 'Datagrams sent per target.'),
+        ('bytes_sent', 'Bytes put on the wire per target.'),
+        ('send_errors', 'Failed sends per target.'),
+    ):
+        lines += [f'# HELP oled_{key}_total {help_text}', f'# TYPE oled_{key}_total counter']
+        for name, sender in senders.items():
+            for target, stats in (sender.stats() if sender else {}).items():
+                lines.append(f'oled_{key}_total{{sender="{name}",target="{target}"}} {stats[key]}')
+
+    if stream_sender:
+        for key, help_text in (
+            ('rate_fps', 'Frame rate the rate controller allows per target.'),
+            ('achieved_fps', 'Frames per second acknowledged by each target.'),
+            ('render_ms', 'Last render time reported by each target.'),
+        ):
+            lines += [f'# HELP oled_target_{key} {help_text}', f'# TYPE oled_target_{key} gauge']
+            for target, stats in stream_sender.stats().items():
+                if stats[key] is not None:
+                    lines.append(f'oled_target_{key}{{target="{target}"}} {stats[key]}')
+
+    lines += ['# HELP oled_streaming Whether a stream is running.', '# TYPE oled_streaming gauge',
+              f'oled_streaming {int(streaming)}']
+    if stream_scheduler:
+        scheduler_stats = stream_scheduler.stats()
+        lines += ['# HELP oled_missed_deadlines_total Frame deadlines dropped by the scheduler.',
+                  '# TYPE oled_missed_deadlines_total counter',
+                  f'oled_missed_deadlines_total {scheduler_stats["missed_deadlines"]}']
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for the frame pipeline."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def http_head(status, headers):
+    """Status line and headers of an HTTP/1.1 response."""
+    lines = [f'HTTP/1.1 {status}'] + [f'{name}: {value}' for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+async def stream_feed(args, writer):
+    """Broadcast preview stream.
+
+    Serves MJPEG (multipart/x-mixed-replace) by default, or with
+    ?format=oled a stream of raw 1024-byte OLED buffers. Each client is a
+    coroutine on the stream loop; a slow one only delays itself.
+    """
+    if args.get('format') == ['oled']:
+        hub, content_type = oled_hub, 'application/octet-stream'
+    else:
+        hub, content_type = preview_hub, 'multipart/x-mixed-replace; boundary=frame'
+    writer.write(http_head('200 OK', [
+        ('Content-Type', content_type),
+        ('Cache-Control', 'no-cache'),
+        ('X-Accel-Buffering', 'no'),
+        # The page is served from the Flask port, so its fetch() is cross-origin
+        ('Access-Control-Allow-Origin', '*'),
+        ('Connection', 'close'),
+    ]))
+    async for chunk in hub.subscribe(lambda: streaming):
+        writer.write(chunk)
+        await writer.drain()
+
+# The preview feeds get their own port on the stream loop; Werkzeug serves the rest
+FEED_PORT = 5001
+FEED_HEADER_TIMEOUT = 10
+FEED_MAX_HEADER = 8192
+
+@app.route('/stream_feed')
+def stream_feed_redirect():
+    """Send preview clients to the feed server on the stream loop."""
+    host = urlsplit(request.host_url).hostname
+    if ':' in host:
+        host = f'[{host}]'  # IPv6
+    url = f'{request.scheme}://{host}:{FEED_PORT}/stream_feed'
+    if request.query_string:
+        url += '?' + request.query_string.decode('latin-1')
+    return redirect(url, 307)
+
+async def read_request_line(reader):
+    """Read a request's line and headers, return the request line.
+
+    Empty lines before it are skipped (RFC 9112 section 2.2). Raises
+    ValueError when the line or the headers exceed FEED_MAX_HEADER.
+    """
+    line = await reader.readline()
+    while line in (b'\r\n', b'\n'):
+        line = await reader.readline()
+    size = len(line)
+    while True:
+        header = await reader.readline()
+        size += len(header)
+        if size > FEED_MAX_HEADER:
+            raise ValueError('Request header too large')
+        if header in (b'\r\n', b'\n', b''):
+            return line
+
+async def handle_feed(reader, writer):
+    """Serve one request on the feed port: GET /stream_feed or a 4xx."""
+    error = None
+    try:
+        try:
+            line = await asyncio.wait_for(read_request_line(reader), FEED_HEADER_TIMEOUT)
+        except ValueError:
+            error = '431 Request Header Fields Too Large'
+        else:
+            parts = line.decode('latin-1').split()
+            path, _, query = parts[1].partition('?') if len(parts) == 3 else ('', '', '')
+            if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+                error = '400 Bad Request'
+            elif path != '/stream_feed':
+                error = '404 Not Found'
+            elif parts[0] != 'GET':
+                error = '405 Method Not Allowed'
+            else:
+                await stream_feed(parse_qs(query), writer)
+        if error:
+            writer.write(http_head(error, [('Content-Length', '0'), ('Connection', 'close')]))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_feed(host='0.0.0.0', port=FEED_PORT):
+    """Serve the preview feeds on the stream loop."""
+    server = await asyncio.start_server(handle_feed, host, port, limit=FEED_MAX_HEADER)
+    async with server:
+        await server.serve_forever()
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='OLED Screen Streamer')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='serve a frame recording instead of the live screen (e.g. on a headless server)')
+    parser.add_argument('--clip-cache-mb', type=float, default=32,
+                        help='memory for converted clips uploaded to /clips (default 32 MB)')
+    args = parser.parse_args()
+    clip_cache.max_bytes = int(args.clip_cache_mb * 1024 * 1024)
+    if args.replay:
+        replay_path = args.replay
+        capture_service.source_factory = lambda: ReplaySource(args.replay)
+    
     print("-" * 50)
     print("OLED Screen Streamer Running at http://localhost:5000")
+    print(f"Preview feeds on port {FEED_PORT}")
     print("Features:")
     print("  • Live screen capture")
-    print("  • Region selection")
+    print("  • Region selection (captured server-side)")
+    print("  • Monitor selection")
     print("  • Adjustable FPS (1-30)")
     print("  • Adjustable quality")
     print("  • Real-time preview")
+    print("  • Looping clips (GIF/APNG/WebP or recordings)")
+    if args.replay:
+        print(f"  • Replaying {args.replay}")
     print("-" * 50)
-    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
\ No newline at end of file
+    stream_core.submit(serve_feed('0.0.0.0', FEED_PORT))
+    app.run(host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""Emulate the ESP32-C3 OLED receiver (C3/C3.ino) on a local UDP port.
+
+    python emulator.py                              # 127.0.0.1:8888
+    python emulator.py --count 4 --port 9000        # four displays on ports 9000-9003
+    python emulator.py --drop 0.05 --png frame.png  # 5% simulated loss, save the screen on exit
+
+Point the server at 127.0.0.1 (or 127.0.0.1:9000,127.0.0.1:9001, ...) and
+the emulator applies packets exactly like the firmware: the same size and
+header checks, stale sequence rejection, the first 256 bytes ignored in
+favour of the local status bar (unless packets carry pages 0-1, which
+switches to full screen), a blocking I2C push per drawn page, and an
+ack back to the sender after every drawn frame (--no-ack for old firmware).
+Every second it prints arrival rate, gaps, jitter, lost and stale packets.
+"""
+import argparse
+import random
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+import code_test as oled
+
+STATUS_BAR_SIZE = 256  # pages 0-1 are drawn by the firmware itself
+MAX_PACKET_SIZE = oled.PACKET_HEADER.size + oled.OLED_BUFFER_SIZE
+IMAGE_PAGES_MASK = 0xFC
+
+# Bits on the wire for one oledDisplayPage(): six 3-byte command transfers
+# and eight 18-byte data transfers, 9 clocks per byte (8 bits + ACK)
+I2C_BITS_PER_PAGE = (6 * 3 + 8 * 18) * 9
+
+class EmulatedDisplay:
+    """One emulated receiver bound to host:port.
+
+    drop is the probability of discarding a datagram before it is handled;
+    with i2c_hz set, drawing blocks for as long as the page pushes would take
+    on the real bus, so packets queue up in the socket buffer as on the device.
+    """
+
+    def __init__(self, host='127.0.0.1', port=oled.OLED_PORT, i2c_hz=400000, drop=0.0, ack=True):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.2)
+        self.address = self.sock.getsockname()
+        self.i2c_hz = i2c_hz
+        self.drop = drop
+        self.ack = ack
+        self.frame = bytearray(oled.OLED_BUFFER_SIZE)
+        self.status_bar = bytearray(STATUS_BAR_SIZE)
+        self.status_bar[oled.OLED_WIDTH:] = b'\x80' * oled.OLED_WIDTH  # separator line
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = dict.fromkeys(
+                ('packets', 'bytes', 'frames', 'legacy_frames', 'pages_drawn',
+                 'rejected', 'stale', 'lost', 'dropped'), 0)
+            self.i2c_busy = 0.0
+            self.first_packet = None
+            self.last_packet = None
+            self.last_sequence = None
+            self.server = None
+            self.full_screen = False
+            self.gaps = oled.Histogram()
+
+    def push_pages(self, count):
+        """Block for the I2C time of drawing count pages, return that time."""
+        seconds = count * I2C_BITS_PER_PAGE / self.i2c_hz if self.i2c_hz else 0.0
+        if seconds:
+            time.sleep(seconds)
+            self.i2c_busy += seconds
+        self.counts['pages_drawn'] += count
+        return seconds
+
+    def send_ack(self, addr, render_seconds, gap_seconds):
+        counts = self.counts
+        rejected = (counts['rejected'] + counts['stale']) & 0xFFFF
+        packet = oled.ACK_PACKET.pack(
+            oled.PACKET_MAGIC, oled.PROTOCOL_VERSION, oled.FLAG_ACK, (self.last_sequence or 0) & 0xFFFF,
+            int(render_seconds * 1e6), min(int(gap_seconds * 1000), 0xFFFF), rejected)
+        try:
+            self.sock.sendto(packet, addr)
+        except OSError:
+            pass
+
+    def handle(self, packet, addr):
+        """Apply one datagram the way loop()/handlePagePacket() do."""
+        now = time.monotonic()
+        counts = self.counts
+        counts['packets'] += 1
+        counts['bytes'] += len(packet)
+        if self.drop and random.random() < self.drop:
+            counts['dropped'] += 1
+            return
+
+        if len(packet) == oled.OLED_BUFFER_SIZE:
+            oled.parse_page_packet(packet, self.frame)
+            counts['legacy_frames'] += 1
+            self.full_screen = False
+            pages = oled.OLED_PAGES  # status bar is redrawn every time
+        elif oled.PACKET_HEADER.size <= len(packet) <= MAX_PACKET_SIZE:
+            try:
+                magic, version, flags, sequence, page_mask = oled.PACKET_HEADER.unpack_from(packet)
+                if magic != oled.PACKET_MAGIC or version != oled.PROTOCOL_VERSION:
+                    raise ValueError('Unknown packet format')
+                # Stale packets are dropped unless they are full keyframes
+                keyframe = page_mask & IMAGE_PAGES_MASK == IMAGE_PAGES_MASK
+                if self.last_sequence is not None:
+                    delta = (sequence - self.last_sequence + 0x8000) % 0x10000 - 0x8000
+                    if delta <= 0 and not keyframe:
+                        counts['stale'] += 1
+                        return
+                    if delta > 1:
+                        counts['lost'] += delta - 1
+                scratch = bytearray(self.frame)
+                oled.parse_page_packet(packet, scratch)
+            except ValueError:
+                counts['rejected'] += 1
+                return
+            self.frame[:] = scratch
+            self.last_sequence = sequence
+            # Pages 0-1 switch to full screen; a keyframe without them switches back
+            redraw_status = addr[0] != self.server
+            if page_mask & ~IMAGE_PAGES_MASK:
+                self.full_screen = True
+            elif keyframe and self.full_screen:
+                self.full_screen = False
+                redraw_status = True
+            if self.full_screen:
+                pages = bin(page_mask).count('1')
+            else:
+                pages = bin(page_mask & IMAGE_PAGES_MASK).count('1') + 2 * redraw_status
+        else:
+            counts['rejected'] += 1
+            return
+
+        self.server = addr[0]
+        counts['frames'] += 1
+        gap = 0.0
+        if self.last_packet is not None:
+            gap = now - self.last_packet
+            self.gaps.observe(gap)
+        else:
+            self.first_packet = now
+        self.last_packet = now
+        render = self.push_pages(pages)
+        if self.ack:
+            self.send_ack(addr, render, gap)
+
+    def run(self, stop):
+        while not stop.is_set():
+            try:
+                packet, addr = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self.lock:
+                self.handle(packet, addr)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            gaps = np.array(self.gaps.recent) * 1000
+            elapsed = (self.last_packet or 0) - (self.first_packet or 0)
+            stats['fps'] = (stats['frames'] - 1) / elapsed if elapsed > 0 else 0.0
+            stats['i2c_busy_s'] = self.i2c_busy
+        if len(gaps):
+            stats.update({
+                'gap_mean_ms': float(gaps.mean()),
+                'gap_p95_ms': float(np.percentile(gaps, 95)),
+                'gap_max_ms': float(gaps.max()),
+                'jitter_ms': float(gaps.std()),
+            })
+        return stats
+
+    def screen(self):
+        """Return the 128x64 screen as shown: local status bar (unless full screen) plus image pages."""
+        with self.lock:
+            status_bar = self.frame[:STATUS_BAR_SIZE] if self.full_screen else self.status_bar
+            buffer = bytes(status_bar) + bytes(self.frame[STATUS_BAR_SIZE:])
+        return oled.decode_oled_pages(buffer, 'full')
+
+    def render(self, path, scale=4):
+        """Save the screen as a PNG scaled up with nearest-neighbour."""
+        image = oled.Image.fromarray(self.screen())
+        image.resize((image.width * scale, image.height * scale), oled.Image.NEAREST).save(path)
+
+    def close(self):
+        self.sock.close()
+
+def format_stats(address, stats):
+    line = (f'{address[0]}:{address[1]}  {stats["fps"]:6.1f} fps  {stats["frames"]} frames'
+            f'  {stats["bytes"] / 1024:.1f} KiB  lost {stats["lost"]}  stale {stats["stale"]}'
+            f'  rejected {stats["rejected"]}  dropped {stats["dropped"]}')
+    if 'gap_mean_ms' in stats:
+        line += (f'  gap {stats["gap_mean_ms"]:.1f}/{stats["gap_p95_ms"]:.1f}/{stats["gap_max_ms"]:.1f} ms'
+                 f' (mean/p95/max)  jitter {stats["jitter_ms"]:.1f} ms')
+    return line
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=oled.OLED_PORT)
+    parser.add_argument('--count', type=int, default=1, help='displays on consecutive ports')
+    parser.add_argument('--drop', type=float, default=0.0, help='probability of dropping a datagram')
+    parser.add_argument('--i2c-hz', type=int, default=400000, help='simulated I2C clock, 0 disables')
+    parser.add_argument('--no-ack', action='store_true', help='do not answer frames (firmware without acks)')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between stats lines')
+    parser.add_argument('--png', help='save the screen here on exit (index added for --count > 1)')
+    parser.add_argument('--scale', type=int, default=4)
+    args = parser.parse_args()
+
+    displays = [EmulatedDisplay(args.host, args.port + i, args.i2c_hz, args.drop, not args.no_ack) for i in range(args.count)]
+    stop = threading.Event()
+    threads = [threading.Thread(target=d.run, args=(stop,), daemon=True) for d in displays]
+    for thread in threads:
+        thread.start()
+
+    print(f'Emulating {len(displays)} display(s) on {args.host}:{args.port}, Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(args.interval)
+            for display in displays:
+                print(format_stats(display.address, display.stats()))
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    for i, display in enumerate(displays):
+        if args.png:
+            path = args.png if len(displays) == 1 else args.png.replace('.png', f'-{i}.png')
+            display.render(path, args.scale)
+            print(f'Saved {path}')
+        display.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Record screen captures and replay them into the UDP sender.
+
+    python recording.py record capture.rec --seconds 10 --fps 30 --region 0,0,640,240
+    python recording.py record oled.rec --kind oled --seconds 10
+    python recording.py replay capture.rec 192.168.1.50 192.168.1.51
+    python recording.py replay capture.rec 127.0.0.1 --realtime
+
+Replay defaults to as-fast-as-possible, which measures the maximum
+throughput of processing and sending without a desktop.
+"""
+import argparse
+import sys
+import threading
+import time
+
+import code_test as oled
+
+def record(args):
+    region = oled.parse_region(args.region)
+    scheduler = oled.FrameScheduler(args.fps)
+    stop = threading.Event()
+    recorder = oled.FrameRecorder(args.path, args.kind)
+    converter = oled.GrayscaleConverter(resample=args.resample)
+    end = time.monotonic() + args.seconds
+
+    with oled.ScreenSource(args.monitor, region) as source:
+        while time.monotonic() < end and scheduler.wait(stop):
+            shot = source.grab()
+            if args.kind == 'bgra':
+                recorder.write(shot.raw, shot.size)
+            else:
+                recorder.write(oled.pack_for_oled(converter.convert(shot), args.dither))
+    recorder.close()
+    print(f'Recorded {recorder.frames} {args.kind} frames to {args.path}')
+    return 0
+
+def replay(args):
+    targets = [oled.parse_target(t) for t in args.targets]
+    sender = oled.FrameSender(protocol=args.protocol, compress=not args.no_compress)
+    converter = oled.GrayscaleConverter(resample=args.resample)
+    frames = sent = 0
+
+    with oled.ReplaySource(args.path, realtime=args.realtime, loop=args.loop) as source:
+        total = args.frames or len(source)
+        start = time.perf_counter()
+        while frames < total:
+            try:
+                shot = source.grab()
+            except EOFError:
+                break
+            buffer = shot.oled
+            if buffer is None:
+                buffer = oled.pack_for_oled(converter.convert(shot), args.dither)
+            sent += sender.send_all(buffer, targets)
+            frames += 1
+        elapsed = time.perf_counter() - start
+
+    errors = sum(stats['send_errors'] for stats in sender.stats().values())
+    sender.close()
+    print(f'{frames} frames to {len(targets)} target(s) in {elapsed:.2f}s: '
+          f'{frames / elapsed:.1f} fps, {sent / elapsed / 1024:.1f} KiB/s, {errors} send errors')
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rec = commands.add_parser('record', help='record the screen to a file')
+    rec.add_argument('path')
+    rec.add_argument('--kind', choices=oled.RECORDING_KINDS, default='bgra',
+                     help='raw captures (bgra) or dithered OLED buffers (oled)')
+    rec.add_argument('--seconds', type=float, default=10)
+    rec.add_argument('--fps', type=float, default=30)
+    rec.add_argument('--monitor', type=int, default=1)
+    rec.add_argument('--region', help='x,y,width,height on the monitor')
+    rec.add_argument('--dither', choices=oled.DITHER_MODES, default='floyd-steinberg')
+    rec.add_argument('--resample', choices=oled.RESAMPLE_FILTERS, default='lanczos')
+    rec.set_defaults(func=record)
+
+    rep = commands.add_parser('replay', help='replay a recording to ESP32 targets')
+    rep.add_argument('path')
+    rep.add_argument('targets', nargs='+', help='"ip" or "ip:port"')
+    rep.add_argument('--realtime', action='store_true', help='keep the recorded frame timing')
+    rep.add_argument('--loop', action='store_true', help='loop until --frames have been sent')
+    rep.add_argument('--frames', type=int, help='number of frames to send (default: one pass)')
+    rep.add_argument('--protocol', choices=oled.PROTOCOLS, default='delta')
+    rep.add_argument('--no-compress', action='store_true', help='never PackBits-encode delta packets')
+    rep.add_argument('--dither', choices=oled.DITHER_MODES, default='floyd-steinberg')
+    rep.add_argument('--resample', choices=oled.RESAMPLE_FILTERS, default='lanczos',
+                     help='filter for the last resize step (box is fastest)')
+    rep.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
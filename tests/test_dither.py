@@ -0,0 +1,64 @@
+"""Floyd-Steinberg dithering against the original per-pixel loop."""
+import numpy as np
+import pytest
+
+import code_test as oled
+
+
+def scalar_floyd_steinberg(gray_array):
+    """The per-pixel loop dither_image used before it was vectorized."""
+    gray_array = np.array(gray_array, dtype=np.float32)
+    height, width = gray_array.shape
+    for y in range(height):
+        for x in range(width):
+            old_pixel = gray_array[y, x]
+            new_pixel = 255 if old_pixel > 127 else 0
+            gray_array[y, x] = new_pixel
+            quant_error = old_pixel - new_pixel
+
+            if x + 1 < width:
+                gray_array[y, x + 1] += quant_error * 7/16
+            if y + 1 < height:
+                if x > 0:
+                    gray_array[y + 1, x - 1] += quant_error * 3/16
+                gray_array[y + 1, x] += quant_error * 5/16
+                if x + 1 < width:
+                    gray_array[y + 1, x + 1] += quant_error * 1/16
+    return gray_array.astype(np.uint8)
+
+
+def assert_matches(gray):
+    assert np.array_equal(oled.dither_array(gray), scalar_floyd_steinberg(gray))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_frames(seed):
+    rng = np.random.default_rng(seed)
+    assert_matches(rng.random((48, 128), dtype=np.float32) * 255)
+    # Whole gray levels, as the converter produces them
+    assert_matches(rng.integers(0, 256, (64, 128)).astype(np.float32))
+
+
+@pytest.mark.parametrize('value', [0, 1, 127, 127.5, 128, 200, 255])
+def test_constant_frames(value):
+    assert_matches(np.full((48, 128), value, dtype=np.float32))
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (1, 2), (1, 37), (2, 1), (37, 1), (2, 2), (3, 5), (7, 13), (48, 1),
+                                   (1, 128), (5, 200), (63, 17)])
+def test_odd_shapes(shape):
+    rng = np.random.default_rng(sum(shape))
+    assert_matches(rng.random(shape, dtype=np.float32) * 255)
+
+
+def test_out_of_range_input():
+    # Errors push neighbours past 0-255; values that start there must match too
+    rng = np.random.default_rng(7)
+    assert_matches(rng.uniform(-100, 400, (48, 128)).astype(np.float32))
+
+
+def test_repeated_calls_reuse_buffers():
+    rng = np.random.default_rng(8)
+    frames = [rng.random((48, 128), dtype=np.float32) * 255 for _ in range(3)]
+    first = [oled.dither_array(frame) for frame in frames]
+    assert all(np.array_equal(oled.dither_array(frame), result) for frame, result in zip(frames, first))
@@ -0,0 +1,128 @@
+"""OledFrame blit, invert and dirty_mask against per-pixel references."""
+import numpy as np
+import pytest
+
+import code_test as oled
+
+
+def bits(frame):
+    """All rows of a frame (status bar included) as a (height, width) bool array."""
+    pages = frame.pages[:, :, None]
+    unpacked = np.unpackbits(pages, axis=-1, bitorder='little')
+    return unpacked.transpose(0, 2, 1).reshape(frame.height, frame.width).astype(bool)
+
+
+def random_frame(rng, layout='full', height=64, width=oled.OLED_WIDTH):
+    frame = oled.OledFrame(layout, height, width)
+    frame[:] = rng.integers(0, 256, len(frame), dtype=np.uint8).tobytes()
+    return frame
+
+
+def reference_blit(dest, source, x, y, op):
+    for sy in range(source.shape[0]):
+        for sx in range(source.shape[1]):
+            dy, dx = y + sy, x + sx
+            if 0 <= dy < dest.shape[0] and 0 <= dx < dest.shape[1]:
+                pixel = source[sy, sx]
+                if op == 'copy':
+                    dest[dy, dx] = pixel
+                elif op == 'or':
+                    dest[dy, dx] |= pixel
+                elif op == 'xor':
+                    dest[dy, dx] ^= pixel
+                else:
+                    dest[dy, dx] &= pixel
+
+
+@pytest.mark.parametrize('op', oled.BLIT_OPS)
+@pytest.mark.parametrize('layout', list(oled.OLED_LAYOUTS))
+def test_blit_matches_reference(op, layout):
+    rng = np.random.default_rng(len(op) * 10 + len(layout))
+    for _ in range(150):
+        dest = random_frame(rng, layout)
+        source = random_frame(rng, 'full', 8 * int(rng.integers(1, 5)), int(rng.integers(1, 60)))
+        # Offsets reach past every edge, with y off the page grid most of the time
+        x = int(rng.integers(-source.width - 4, oled.OLED_WIDTH + 4))
+        y = int(rng.integers(-source.height - 4, 64 + 4))
+        expected = bits(dest)
+        reference_blit(expected, bits(source), x, y, op)
+        dest.blit(source, x, y, op)
+        assert np.array_equal(bits(dest), expected), (x, y, source.width, source.height)
+
+
+@pytest.mark.parametrize('y', range(-9, 10))
+def test_blit_every_bit_shift(y):
+    rng = np.random.default_rng(100 + y)
+    dest = random_frame(rng)
+    source = random_frame(rng, 'full', 16, 20)
+    expected = bits(dest)
+    reference_blit(expected, bits(source), 3, y, 'copy')
+    dest.blit(source, 3, y)
+    assert np.array_equal(bits(dest), expected)
+
+
+def test_blit_fully_outside_is_a_no_op():
+    rng = np.random.default_rng(1)
+    dest = random_frame(rng)
+    before = bytes(dest)
+    source = random_frame(rng, 'full', 8, 10)
+    for x, y in [(-10, 0), (128, 0), (0, -8), (0, 64), (-50, -50), (200, 200)]:
+        dest.blit(source, x, y)
+    assert bytes(dest) == before
+
+
+def test_blit_rejects_unknown_op():
+    with pytest.raises(ValueError):
+        oled.OledFrame().blit(oled.OledFrame('full', 8, 8), op='nand')
+
+
+@pytest.mark.parametrize('layout', list(oled.OLED_LAYOUTS))
+def test_invert_matches_reference(layout):
+    rng = np.random.default_rng(len(layout))
+    for _ in range(300):
+        frame = random_frame(rng, layout)
+        top = frame.first_page * 8
+        x = int(rng.integers(-20, 140))
+        y = int(rng.integers(-20, 70))
+        width = int(rng.integers(0, 140))
+        height = int(rng.integers(0, 70))
+        expected = bits(frame)
+        rows = slice(top + max(y, 0), top + max(y + height, 0))
+        cols = slice(max(x, 0), max(x + width, 0))
+        expected[rows, cols] ^= True
+        frame.invert(x, y, width, height)
+        assert np.array_equal(bits(frame), expected), (x, y, width, height)
+
+
+@pytest.mark.parametrize('layout', list(oled.OLED_LAYOUTS))
+def test_invert_whole_image_leaves_status_bar(layout):
+    rng = np.random.default_rng(3)
+    frame = random_frame(rng, layout)
+    expected = bits(frame)
+    expected[frame.first_page * 8:] ^= True
+    assert np.array_equal(bits(frame.invert()), expected)
+
+
+@pytest.mark.parametrize('layout', list(oled.OLED_LAYOUTS))
+def test_dirty_mask_matches_reference(layout):
+    rng = np.random.default_rng(5 + len(layout))
+    for _ in range(200):
+        frame = random_frame(rng, layout)
+        other = bytearray(frame)
+        for _ in range(int(rng.integers(0, 4))):
+            other[int(rng.integers(0, len(other)))] ^= 1 << int(rng.integers(0, 8))
+        expected = 0
+        for page in range(frame.first_page, frame.height // 8):
+            rows = slice(page * frame.width, (page + 1) * frame.width)
+            if frame[rows] != other[rows]:
+                expected |= 1 << page
+        assert frame.dirty_mask(other) == expected
+
+
+def test_diff_and_pixels_round_trip():
+    rng = np.random.default_rng(9)
+    pixels = rng.integers(0, 2, (48, 128)).astype(np.uint8) * 255
+    frame = oled.OledFrame.from_pixels(pixels)
+    assert np.array_equal(frame.pixels(), pixels)
+    other = random_frame(rng, 'split')
+    assert np.array_equal(bits(frame.diff(other)), bits(frame) ^ bits(other))
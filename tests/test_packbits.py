@@ -0,0 +1,122 @@
+"""Round-trip tests for the PackBits payload encoding and page packets."""
+import numpy as np
+import pytest
+
+import code_test as oled
+
+
+def round_trip(data):
+    encoded = oled.packbits_encode(data)
+    assert encoded is not None
+    assert oled.packbits_decode(encoded, len(data)) == data
+    return encoded
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_data(seed):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, 256, int(rng.integers(1, 2048)), dtype=np.uint8).tobytes()
+    round_trip(data)
+
+
+@pytest.mark.parametrize('value', [0x00, 0xFF, 0x5A])
+def test_constant_data(value):
+    data = bytes([value]) * 1024
+    assert len(round_trip(data)) == 16
+
+
+def test_mixed_data():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        parts = []
+        for _ in range(int(rng.integers(1, 12))):
+            if rng.random() < 0.5:
+                parts.append(bytes([int(rng.integers(0, 256))]) * int(rng.integers(1, 300)))
+            else:
+                parts.append(rng.integers(0, 256, int(rng.integers(1, 300)), dtype=np.uint8).tobytes())
+        round_trip(b''.join(parts))
+
+
+@pytest.mark.parametrize('length', range(1, 1025))
+def test_run_lengths(length):
+    # A run on its own, between literals and between other runs
+    run = b'\xff' * length
+    round_trip(run)
+    round_trip(b'\x01\x02' + run + b'\x03')
+    round_trip(b'\x00' * 5 + run + b'\x00' * 3)
+
+
+@pytest.mark.parametrize('multiple', range(1, 9))
+@pytest.mark.parametrize('offset', [-2, -1, 0, 1, 2, 3])
+def test_runs_around_multiples_of_128(multiple, offset):
+    data = b'\x12\x34' + b'\x00' * (multiple * 128 + offset) + b'\x56'
+    encoded = round_trip(data)
+    # Every header must be a valid literal or run header
+    i = 0
+    while i < len(encoded):
+        header = encoded[i]
+        assert header != 128
+        i += 1 + (header + 1 if header < 128 else 1)
+
+
+def test_empty():
+    assert oled.packbits_encode(b'') == b''
+    assert oled.packbits_decode(b'') == b''
+
+
+def test_limit_fallback():
+    noise = np.random.default_rng(2).integers(0, 256, 1024, dtype=np.uint8).tobytes()
+    assert oled.packbits_encode(noise, limit=len(noise) - 1) is None
+    zeros = bytes(1024)
+    assert oled.packbits_encode(zeros, limit=15) is None
+    assert oled.packbits_encode(zeros, limit=16) is not None
+
+
+def test_decode_size_mismatch():
+    with pytest.raises(ValueError):
+        oled.packbits_decode(oled.packbits_encode(bytes(100)), 99)
+
+
+@pytest.mark.parametrize('page_mask', [0xFC, 0xFF, 0x24])
+def test_page_packet_round_trip(page_mask):
+    rng = np.random.default_rng(page_mask)
+    frame = bytearray(oled.OLED_BUFFER_SIZE)
+    frame[256:512] = bytes(256)
+    frame[512:] = rng.integers(0, 256, 512, dtype=np.uint8).tobytes()
+    for compress in (False, True):
+        packet = oled.build_page_packet(frame, page_mask, 7, compress=compress)
+        target = bytearray(oled.OLED_BUFFER_SIZE)
+        assert oled.parse_page_packet(packet, target) == (7, page_mask)
+        for page in range(oled.OLED_PAGES):
+            rows = slice(page * oled.OLED_WIDTH, (page + 1) * oled.OLED_WIDTH)
+            expected = frame[rows] if page_mask >> page & 1 else bytes(oled.OLED_WIDTH)
+            assert target[rows] == expected
+
+
+def test_compressed_packet_is_never_legacy_size():
+    # Noise with one run of zeros, grown until the payload compresses to 1018 bytes
+    noise = np.random.default_rng(3).integers(0, 256, 1024, dtype=np.uint8).tobytes()
+    found = 0
+    for length in range(3, 64):
+        frame = bytearray(noise)
+        frame[100:100 + length] = bytes(length)
+        packed = oled.packbits_encode(bytes(frame), oled.OLED_BUFFER_SIZE - 1)
+        if packed is None or oled.PACKET_HEADER.size + len(packed) != oled.OLED_BUFFER_SIZE:
+            continue
+        found += 1
+        packet = oled.build_page_packet(frame, 0xFF, 1, compress=True)
+        assert len(packet) != oled.OLED_BUFFER_SIZE
+        target = bytearray(oled.OLED_BUFFER_SIZE)
+        oled.parse_page_packet(packet, target)
+        assert target == frame
+    assert found
+
+
+def test_sender_handles_long_runs():
+    pixels = np.zeros((48, 128), dtype=np.uint8)
+    pixels[0, 0] = pixels[8, 2] = 255
+    sender = oled.FrameSender(compress=True)
+    try:
+        assert sender.send(oled.encode_oled_pages(pixels), ('127.0.0.1', 9))
+    finally:
+        sender.close()
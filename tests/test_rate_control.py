@@ -0,0 +1,106 @@
+"""RateController and adaptive FrameSender behaviour on a simulated clock."""
+import numpy as np
+import pytest
+
+import code_test as oled
+
+
+def simulate(seconds, requested=30.0, display_fps=None, loss=0.0, render_ms=5.0, seed=0, acks=True):
+    """Offer frames at requested FPS to a simulated display, return (controller, frames sent, rate per tick).
+
+    The display draws at most display_fps frames a second and drops what
+    arrives while it is busy; loss drops that share of frames on the link.
+    """
+    rng = np.random.default_rng(seed)
+    rate = oled.RateController()
+    rate.window_start = 0.0
+    busy_until = 0.0
+    sent = 0
+    rates = []
+    for tick in range(int(seconds * requested)):
+        now = tick / requested
+        rate.update(now, requested)
+        if rate.allow(now):
+            rate.on_send()
+            sent += 1
+            lost = rng.random() < loss
+            busy = display_fps is not None and now < busy_until
+            if acks and not lost and not busy:
+                if display_fps:
+                    busy_until = now + 1 / display_fps
+                rate.on_ack({'sequence': sent, 'render_ms': render_ms, 'gap_ms': 0, 'rejected': 0})
+        rates.append(rate.fps)
+    return rate, sent, rates
+
+
+def test_steady_acks_keep_the_requested_fps():
+    rate, sent, rates = simulate(20)
+    assert sent == 20 * 30
+    assert set(rates[30:]) == {30.0}
+    assert rate.achieved_fps == pytest.approx(30, rel=0.05)
+    assert rate.link_loss == 0
+
+
+def test_displays_without_acks_get_every_frame():
+    rate, sent, rates = simulate(10, acks=False)
+    assert sent == 10 * 30
+    assert rate.fps is None
+
+
+def test_lagging_display_backs_off():
+    # Reports a short render time, so only the missing acks show it is behind
+    rate, sent, rates = simulate(40, display_fps=12, render_ms=2)
+    settled = rates[10 * 30:]
+    assert max(settled) <= 12
+    assert min(settled) >= rate.min_fps
+    # It still gets most of what it can draw
+    assert sent / 40 >= 0.6 * 12
+
+
+def test_render_time_caps_the_rate():
+    rate, sent, rates = simulate(10, render_ms=50)
+    assert max(rates[30:]) <= 20
+    assert rate.fps == pytest.approx(20)
+
+
+@pytest.mark.parametrize('loss', [0.05, 0.1, 0.3])
+@pytest.mark.parametrize('seed', range(3))
+def test_random_loss_does_not_ratchet_the_rate_down(loss, seed):
+    rate, sent, rates = simulate(60, loss=loss, seed=seed)
+    late = rates[30 * 30:]
+    # Occasional probes back off, but the rate keeps coming back to the request
+    assert np.mean(late) >= 0.8 * 30
+    assert max(late) == 30
+    if loss >= 0.3:
+        assert rate.link_loss > 0.15
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append(addr)
+
+    def recvfrom(self, bufsize):
+        raise BlockingIOError
+
+
+def test_send_together_throttles_a_wall_as_one(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(oled.time, 'monotonic', lambda: clock[0])
+    sock = FakeSocket()
+    sender = oled.FrameSender(sock, compress=False, adaptive=True)
+    fast, slow = ('10.0.0.1', 8888), ('10.0.0.2', 8888)
+    sender._state(fast)['rate'].fps = 30.0
+    sender._state(slow)['rate'].fps = 5.0
+    rng = np.random.default_rng(0)
+    for tick in range(60):
+        clock[0] = tick / 30
+        frames = [rng.integers(0, 256, oled.OLED_BUFFER_SIZE, dtype=np.uint8).tobytes() for _ in range(2)]
+        sender.send_together(frames, [fast, slow])
+    stats = sender.stats()
+    # Both tiles go at the slow tile's rate, and always together
+    assert sock.sent.count(fast) == sock.sent.count(slow)
+    assert 9 <= sock.sent.count(slow) <= 12
+    assert stats['10.0.0.1:8888']['frames_throttled'] == stats['10.0.0.2:8888']['frames_throttled']